@@ -1,7 +1,5 @@
 #!python3
 # -*- coding: ascii -*-
-from __future__ import print_function
-
 from collections import (
     defaultdict,
     OrderedDict,
@@ -12,11 +10,16 @@ from . import formatter
 from .formatcontext import (
     FormatContextBuilder,
     get_output_stream,
+    iter_chunks,
     NullColorScheme,
     Options
 )
+import array
+import builtins
 from io import StringIO
-import inspect
+import sys
+# _thread rather than threading, which is slow to import
+import _thread
 
 def ap(*a):
     """
@@ -41,61 +44,224 @@ def ap(*a):
     if a:
         for obj in a:
             pprint(obj)
-    obj = inspect.getouterframes(inspect.currentframe())[1][0].f_locals['_']
+        return
+    frame = sys._getframe(1)
+    try:
+        obj = frame.f_locals['_']
+    except KeyError:
+        try:
+            obj = builtins._
+        except AttributeError:
+            raise NameError("name '_' is not defined")
+    finally:
+        del frame
     pprint(obj)
 
 
-def pprint(obj, stream=None, colored=True, **kw):
+def pprint(obj, stream=None, colored=True, streaming=False, **kw):
     '''
     Pretty-print a Python object to a stream [default is sys.stdout].
+    If streaming is true, the output is written in chunks as it is
+    formatted instead of being built in memory first.
     '''
-    stream = get_output_stream(stream, colored)
-    options = Options(**kw)
-    AwesomePrinter(stream=stream, options=options).pprint(obj)
-    print(file=stream)
+    _printer(colored, kw).pprint(obj, stream, streaming)
 
 
-def pformat(obj, **kw):
+def pformat(obj, workers=None, **kw):
     '''
     Format a Python object into a pretty-printed representation.
+    If workers is more than 1, the items of large containers are
+    formatted in that many processes, where the platform can fork.
+    '''
+    return _printer(False, kw).pformat(obj, workers)
+
+
+def iter_pformat(obj, chunk_size=None, **kw):
     '''
-    stream = StringIO()
-    options = Options(color_scheme=NullColorScheme(), **kw)
-    AwesomePrinter(stream=stream, options=options).pprint(obj)
-    return stream.getvalue()
+    Format a Python object like pformat, yielding the result
+    as str chunks of about chunk_size characters.
+    '''
+    return _printer(False, kw).iter_pformat(obj, chunk_size)
+
+
+DEFAULT_TYPE_FORMATTERS = [
+    (types.MethodType, formatter.format_method),
+    (types.FunctionType, formatter.format_function),
+    (type, formatter.format_type),
+    (str, formatter.format_str),
+    (list, formatter.format_list),
+    (defaultdict, formatter.format_defaultdict),
+    (OrderedDict, formatter.format_OrderedDict),
+    (dict, formatter.format_dict),
+    (bool, formatter.format_bool),
+    (int, formatter.format_int),
+    (float, formatter.format_float),
+    (set, formatter.format_set),
+    (tuple, formatter.format_tuple),
+    (bytes, formatter.format_bytes),
+    (bytearray, formatter.format_bytearray),
+    (array.array, formatter.format_array),
+    (memoryview, formatter.format_memoryview),
+    (range, formatter.format_range),
+    (type({}.keys()), formatter.format_dict_keys),
+    (type({}.values()), formatter.format_dict_values),
+    (type({}.items()), formatter.format_dict_items),
+    # Matched by name: numpy is not imported by aprint
+    ("numpy.ndarray", formatter.format_ndarray),
+]
+
+
+def default_builder():
+    '''
+    Create a FormatContextBuilder with the built-in formatters registered
+    '''
+    builder = FormatContextBuilder(
+        formatter.format_object,
+        formatter.format_recursive_object,
+    )
+    for t, f in DEFAULT_TYPE_FORMATTERS:
+        builder.add_type_formatter(t, f)
+    # Namedtuples, dataclasses and objects without a repr of their own
+    builder.add_type_predicate_formatter(
+        formatter.has_instance_fields, formatter.format_instance)
+    builder.add_type_predicate_formatter(
+        formatter.is_iterator, formatter.format_iterator)
+    return builder
+
+# Shared by every Printer until it registers formatters of its own
+_default_builder = default_builder()
 
 
 class AwesomePrinter:
-    def __init__(self, stream, options):
+    chunk_size = 16 * 1024
+    
+    def __init__(self, stream, options, builder=None):
         self._stream = stream
         self._options = options
+        self._builder = builder or _default_builder
     
-    def pprint(self, obj):
+    def pprint(self, obj, streaming=False):
+        # JSON is always streamed: it is made of str chunks, not Text
+        if streaming or self._options["doctype"] != "text":
+            for chunk in self.iter_pformat(obj):
+                self._stream.write(chunk)
+            return
         context = self._context()
         text = context.format(obj)
-        s = text.to_str(self._options.colorizer())
+        renderer = self._options.renderer()
+        s = renderer(text) + renderer.close()
         self._stream.write(s)
+        profile = context.profile()
+        if profile is not None:
+            profile.segments += sum(1 for _ in text.segments())
+            profile.output_chars += len(s)
+            profile.done()
+    
+    def iter_pformat(self, obj, chunk_size=None):
+        context = self._context()
+        profile = context.profile()
+        texts = context.iter_format(obj)
+        if profile is not None:
+            texts = profile.iter_texts(texts)
+        chunks = iter_chunks(
+            texts,
+            self._options.renderer(),
+            chunk_size or self.chunk_size)
+        if profile is not None:
+            chunks = profile.iter_output(chunks)
+        return chunks
     
     def _context(self):
-        builder = FormatContextBuilder(
-            formatter.format_object,
-            formatter.format_recursive_object,
-        )
-        types_to_format = [
-            types.MethodType,
-            types.FunctionType,
-            type,
-            str,
-            list,
-            defaultdict,
-            OrderedDict,
-            dict,
-            bool,
-            int,
-            float,
-            set,
-            tuple,
-        ]
-        for t in types_to_format:
-            builder.add_type_formatter(t, eval("formatter.format_" + t.__name__))
-        return builder.build(self._options)
+        return self._builder.build(self._options)
+
+
+class Printer:
+    '''
+    Reusable pretty printer.
+    Options and formatters are set up once, so a Printer can be shared
+    and called from several threads; each call formats in its own context.
+    
+    >>> printer = Printer(indent=2)
+    >>> print(printer.pformat([1, 2]))
+    [
+      [0] 1
+      [1] 2
+    ]
+    '''
+    def __init__(self, colored=True, builder=None, **kw):
+        self._colored = colored
+        self._builder = builder or _default_builder
+        self._lock = _thread.allocate_lock()
+        # color_scheme only applies to colored output
+        color_scheme = kw.pop("color_scheme", None)
+        if colored:
+            self._options = Options(color_scheme=color_scheme, **kw)
+        else:
+            self._options = Options(color_scheme=NullColorScheme(), **kw)
+        self._plain_options = Options(color_scheme=NullColorScheme(), **kw)
+    
+    def add_type_formatter(self, type, formatter, recursive=False, priority=0):
+        '''
+        Register a formatter for this printer only
+        '''
+        with self._lock:
+            builder = self._builder.copy()
+            builder.add_type_formatter(type, formatter, recursive, priority)
+            self._builder = builder
+    
+    def pprint(self, obj, stream=None, streaming=False):
+        '''
+        Pretty-print a Python object to a stream [default is sys.stdout].
+        '''
+        stream = get_output_stream(stream, self._colored)
+        AwesomePrinter(stream, self._options, self._builder).pprint(obj, streaming)
+        print(file=stream)
+    
+    def pformat(self, obj, workers=None):
+        '''
+        Format a Python object into a pretty-printed representation.
+        If workers is more than 1, format in that many processes (see pformat).
+        '''
+        if workers is not None and workers > 1:
+            # Imported here since multiprocessing is slow to import
+            from . import parallel
+            s = parallel.pformat(obj, self._builder, self._plain_options, workers)
+            if s is not None:
+                return s
+        stream = StringIO()
+        AwesomePrinter(stream, self._plain_options, self._builder).pprint(obj)
+        return stream.getvalue()
+    
+    def iter_pformat(self, obj, chunk_size=None):
+        '''
+        Format a Python object like pformat, yielding str chunks
+        '''
+        printer = AwesomePrinter(None, self._plain_options, self._builder)
+        return printer.iter_pformat(obj, chunk_size)
+
+
+_default_printers = {}
+
+# Printers of the calls with options, by their options; forgotten all at
+# once when full, as calls with ever new options would make it grow
+_option_printers = {}
+MAX_OPTION_PRINTERS = 64
+
+def _printer(colored, kw):
+    if kw:
+        try:
+            # The types tell apart equal options like 1 and True
+            key = (colored, frozenset((k, type(v), v) for k, v in kw.items()))
+            return _option_printers[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # An unhashable option, like a color scheme
+            return Printer(colored, **kw)
+        if len(_option_printers) >= MAX_OPTION_PRINTERS:
+            _option_printers.clear()
+        return _option_printers.setdefault(key, Printer(colored, **kw))
+    try:
+        return _default_printers[colored]
+    except KeyError:
+        return _default_printers.setdefault(colored, Printer(colored))
@@ -1,13 +1,13 @@
 #!python3
 # -*- coding: ascii -*-
 import sys
+from time import perf_counter
+from weakref import WeakKeyDictionary
 
-from copy import copy
-from contextlib import contextmanager
-import operator
 from collections import (
     defaultdict,
     namedtuple,
+    OrderedDict,
 )
 
 from abc import (
@@ -15,9 +15,8 @@ from abc import (
     abstractmethod
 )
 
-import colorama
-if sys.platform == 'win32':
-    import colorama.ansitowin32
+# colorama is imported only when colors are rendered (or on win32, when
+# the colored output stream is created), to keep "import aprint" fast.
 
 
 def get_output_stream(stream, colored):
@@ -27,32 +26,100 @@ def get_output_stream(stream, colored):
     if not colored or sys.platform != 'win32':
         return sys.stdout
     
+    import colorama.ansitowin32
     return colorama.ansitowin32.AnsiToWin32(sys.stdout, True, True, True)
 
 
 class ColorScheme(defaultdict):
     def __init__(self):
         defaultdict.__init__(self, lambda: None)
+        self._table = None
+    
+    def __setitem__(self, key, value):
+        defaultdict.__setitem__(self, key, value)
+        self._table = None
+    
+    def __delitem__(self, key):
+        defaultdict.__delitem__(self, key)
+        self._table = None
+    
+    def __ior__(self, other):
+        self.update(other)
+        return self
+    
+    def update(self, *args, **kw):
+        defaultdict.update(self, *args, **kw)
+        self._table = None
+    
+    def setdefault(self, key, default=None):
+        self._table = None
+        return defaultdict.setdefault(self, key, default)
+    
+    def pop(self, key, *default):
+        self._table = None
+        return defaultdict.pop(self, key, *default)
+    
+    def popitem(self):
+        self._table = None
+        return defaultdict.popitem(self)
+    
+    def clear(self):
+        defaultdict.clear(self)
+        self._table = None
+    
+    def compile(self):
+        '''
+        Build the table color_key -> (prefix, suffix) of escape sequences.
+        Color keys with the same sequences share the same tuple.
+        '''
+        import colorama
+        
+        # RESET_ALL also resets the foreground and background colors
+        reset = colorama.Style.RESET_ALL
+        sequences = {}
+        table = {}
+        color_keys = set(key[0] for key, value in self.items() if value is not None)
+        for color_key in color_keys:
+            prefix = ""
+            bg = self.get((color_key, "bg"))
+            fg = self.get((color_key, "fg"))
+            style = self.get((color_key, "style"))
+            if bg is not None:
+                prefix += getattr(colorama.Back, bg.upper())
+            if fg is not None:
+                prefix += getattr(colorama.Fore, fg.upper())
+            if style is not None:
+                prefix += getattr(colorama.Style, style.upper())
+            table[color_key] = sequences.setdefault(prefix, (prefix, reset))
+        return table
+    
+    def table(self):
+        '''
+        The compiled table, rebuilt only after the scheme is modified
+        '''
+        if self._table is None:
+            self._table = self.compile()
+        return self._table
     
     def colorizer(self):
         return self.colorize
     
     def colorize(self, astr, color_key):
-        if color_key is None:
+        sequences = self.table().get(color_key)
+        if sequences is None:
             return astr
-        
-        fg = self[color_key, "fg"]
-        bg = self[color_key, "bg"]
-        style = self[color_key, "style"]
-        
-        if style is not None:
-            astr = getattr(colorama.Style, style.upper()) + astr
-        if fg is not None:
-            astr = getattr(colorama.Fore, fg.upper()) + astr
-        if bg is not None:
-            astr = getattr(colorama.Back, bg.upper()) + astr
-        astr += colorama.Back.RESET + colorama.Fore.RESET + colorama.Style.RESET_ALL
-        return astr
+        prefix, suffix = sequences
+        return prefix + astr + suffix
+    
+    def renderer(self):
+        # A subclass that colors differently is honored chunk by chunk
+        if (type(self).colorize is not ColorScheme.colorize
+                or type(self).colorizer is not ColorScheme.colorizer):
+            return ColorizerRenderer(self.colorizer())
+        return ColorRenderer(self.table())
+    
+    def text_type(self):
+        return ComplexText
 
 for name in 'BLACK BLUE CYAN GREEN MAGENTA RED WHITE YELLOW BRIGHT DIM NORMAL'.split():
     setattr(ColorScheme, name.upper(), name.upper()) 
@@ -98,21 +165,148 @@ class NullColorScheme:
     
     def colorize(self, astr, color_key):
         return astr
+    
+    def renderer(self):
+        return PlainRenderer()
+    
+    def text_type(self):
+        return PlainText
+
+
+class PlainRenderer:
+    '''
+    Render Text (or str) chunks without colors
+    '''
+    __slots__ = ()
+    
+    def __call__(self, text):
+        if isinstance(text, str):
+            return text
+        return text.to_str()
+    
+    def close(self):
+        return ""
+
+
+class ColorizerRenderer:
+    '''
+    Render Text (or str) chunks with the colorizer of a color scheme,
+    for schemes without a renderer method
+    '''
+    __slots__ = ('_colorizer',)
+    
+    def __init__(self, colorizer):
+        self._colorizer = colorizer
+    
+    def __call__(self, text):
+        if isinstance(text, str):
+            return self._colorizer(text, None)
+        return text.to_str(self._colorizer)
+    
+    def close(self):
+        return ""
+
+
+class ColorRenderer:
+    '''
+    Render Text (or str) chunks with a compiled color table.
+    Escape sequences are only emitted where the color changes; the color
+    open at the end of a chunk carries over to the next one, and close()
+    returns the sequence ending the document.
+    '''
+    __slots__ = ('_table', '_current')
+    
+    def __init__(self, table):
+        self._table = table
+        self._current = None
+    
+    def __call__(self, text):
+        if isinstance(text, str):
+            segments = (SingleText(text),)
+        else:
+            segments = text.segments()
+        table = self._table
+        current = self._current
+        out = []
+        for segment in segments:
+            sequences = table.get(segment._color)
+            if sequences is not current:
+                if current is not None:
+                    out.append(current[1])
+                if sequences is not None:
+                    out.append(sequences[0])
+                current = sequences
+            out.append(segment._string)
+        self._current = current
+        return "".join(out)
+    
+    def close(self):
+        current, self._current = self._current, None
+        if current is None:
+            return ""
+        return current[1]
 
 
 class Options(dict):
-    def __init__(self, indent=4, limit=7, doctype="text", plain=True, color_scheme=None, multiline=True):
+    def __init__(self, indent=4, limit=7, doctype="text", plain=True, color_scheme=None, multiline=True,
+            width=None, sort_keys="sorted", max_str_length=32,
+            max_depth=None, max_nodes=None, max_output_chars=None,
+            engine="auto", iterative_depth=4, memo=None, shared_refs=False,
+            profile=None, peek=0):
         dict.__init__(self)
         self["indent"] = indent
         self["limit"] = limit
+        if doctype not in ("text", "json", "jsonl"):
+            raise ValueError(
+                "doctype must be 'text', 'json' or 'jsonl', not {!r}".format(doctype))
         self["doctype"] = doctype
         self["plain"] = plain
         self["color_scheme"] = color_scheme or DefaultColorScheme()
         self["multiline"] = multiline
+        self["width"] = width
+        # True and False as in json.dumps
+        if sort_keys is True:
+            sort_keys = "sorted"
+        elif sort_keys is False:
+            sort_keys = "insertion"
+        if sort_keys not in ("sorted", "insertion") and not callable(sort_keys):
+            raise ValueError(
+                "sort_keys must be 'sorted', 'insertion', a bool or a function, "
+                "not {!r}".format(sort_keys))
+        self["sort_keys"] = sort_keys
         self["limit_key_length"] = 16
+        self["max_str_length"] = max_str_length
+        self["max_depth"] = max_depth
+        self["max_nodes"] = max_nodes
+        self["max_output_chars"] = max_output_chars
+        self["engine"] = engine
+        self["iterative_depth"] = iterative_depth
+        self["memo"] = memo
+        self["shared_refs"] = shared_refs
+        self["profile"] = profile
+        self["peek"] = peek
     
     def colorizer(self):
         return self["color_scheme"].colorizer()
+    
+    def renderer(self):
+        if self["doctype"] != "text":
+            return PlainRenderer()
+        renderer = getattr(self["color_scheme"], "renderer", None)
+        if renderer is None:
+            return ColorizerRenderer(self.colorizer())
+        return renderer()
+    
+    def text_type(self):
+        '''
+        The Text class formatters build: PlainText if nothing is colored
+        '''
+        if self["doctype"] != "text":
+            return PlainText
+        text_type = getattr(self["color_scheme"], "text_type", None)
+        if text_type is None:
+            return ComplexText
+        return text_type()
 
 
 class Text:
@@ -120,6 +314,7 @@ class Text:
     String with style info. Used to abstract colorama
     '''
     __meta__ = ABCMeta
+    __slots__ = ()
     
     @abstractmethod
     def to_str(self):
@@ -128,6 +323,13 @@ class Text:
         '''
         pass
     
+    @abstractmethod
+    def segments(self):
+        '''
+        Iterate SingleText instances composing this text, in order
+        '''
+        pass
+    
     @abstractmethod
     def __add__(self):pass
 
@@ -151,14 +353,13 @@ class SingleText(Text):
     String with style info. Used to abstract colorama.
     Represents string colored with one color.
     '''
+    __slots__ = ('_string', '_color')
+    
     def __init__(self, string='', color=None):
-        Text.__init__(self)
         self._string = string
         self._color = color
     
     def __add__(self, t):
-        if isinstance(t, str):
-            t = SingleText(t)
         ret = ComplexText()
         ret += self
         ret += t
@@ -170,6 +371,13 @@ class SingleText(Text):
         else:
             return colorizer(self._string, self._color)
     
+    def __copy__(self):
+        # Immutable
+        return self
+    
+    def segments(self):
+        yield self
+    
     def __len__(self):
         return len(self._string)
 
@@ -180,77 +388,1104 @@ class ComplexText(Text):
     Represents string colored with multiple colors or
     concatenated SingleText instances.
     This type is basically immutable, but mutable by __iadd__.
+    
+    Internally a rope: segments are kept in an append-only buffer,
+    and adding a large ComplexText links its buffer instead of copying it.
+    A linked buffer is copied by its owner before the owner is modified
+    again.  Adjacent segments of the same color are not merged when
+    building, which would copy the run on each append, but when rendering.
     '''
+    __slots__ = ('_parts', '_length', '_shared')
+    
+    # A ComplexText with at most this many parts is inlined when added
+    # to another one; larger ones are linked.
+    INLINE_PARTS = 4
+    
     def __init__(self, string='', color=None):
-        Text.__init__(self)
-        self._subtexts = []
+        self._parts = []
+        self._length = 0
+        self._shared = False
         if string != '':
-            self += SingleText(string, color)
+            self._parts.append(SingleText(string, color))
+            self._length = len(string)
     
     def __iadd__(self, t):
+        if t is self:
+            t = t.__copy__()
+        if self._shared:
+            self._parts = list(self._parts)
+            self._shared = False
+        
         if isinstance(t, str):
-            self._subtexts.append(SingleText(t))
+            if t:
+                self._parts.append(SingleText(t))
+                self._length += len(t)
         elif isinstance(t, SingleText):
-            self._subtexts.append(t)
+            if t._string:
+                self._parts.append(t)
+                self._length += len(t._string)
+        elif not isinstance(t, ComplexText):
+            self._parts.extend(t.segments())
+            self._length += len(t)
         else:
-            assert isinstance(t, ComplexText)
-            self._subtexts.extend(t._subtexts)
+            if len(t._parts) <= self.INLINE_PARTS:
+                self._parts.extend(t._parts)
+            else:
+                t._shared = True
+                self._parts.append(t._parts)
+            self._length += t._length
         return self
     
     def __add__(self, t):
-        text = copy(self)
+        text = ComplexText()
+        text += self
         text += t
         return text
     
+    def __copy__(self):
+        text = ComplexText()
+        text += self
+        return text
+    
+    def segments(self):
+        stack = [iter(self._parts)]
+        while stack:
+            for part in stack[-1]:
+                if type(part) is list:
+                    stack.append(iter(part))
+                    break
+                yield part
+            else:
+                stack.pop()
+    
+    def to_str(self, colorizer=None):
+        if colorizer is None:
+            return "".join(text._string for text in self.segments())
+        # Runs of the same color are colorized at once
+        out = []
+        run = []
+        color = None
+        for text in self.segments():
+            if run and text._color != color:
+                out.append(colorizer("".join(run), color))
+                run = []
+            color = text._color
+            run.append(text._string)
+        if run:
+            out.append(colorizer("".join(run), color))
+        return "".join(out)
+    
+    def __len__(self):
+        return self._length
+
+
+class PlainText(Text):
+    '''
+    Text without colors, for output rendered by PlainRenderer.
+    Made of str parts only: colors are dropped when the text is built.
+    Large PlainTexts are linked like large ComplexTexts.
+    '''
+    __slots__ = ('_parts', '_length', '_shared')
+    
+    INLINE_PARTS = 16
+    
+    def __init__(self, string='', color=None):
+        if string:
+            self._parts = [string]
+        else:
+            self._parts = []
+        self._length = len(string)
+        self._shared = False
+    
+    def __iadd__(self, t):
+        if t is self:
+            t = t.__copy__()
+        if self._shared:
+            self._parts = list(self._parts)
+            self._shared = False
+        
+        if type(t) is str:
+            if t:
+                self._parts.append(t)
+                self._length += len(t)
+        elif type(t) is PlainText:
+            if len(t._parts) <= self.INLINE_PARTS:
+                self._parts.extend(t._parts)
+            else:
+                t._shared = True
+                self._parts.append(t._parts)
+            self._length += t._length
+        else:
+            s = t.to_str()
+            if s:
+                self._parts.append(s)
+                self._length += len(s)
+        return self
+    
+    def __add__(self, t):
+        text = PlainText()
+        text += self
+        text += t
+        return text
+    
+    def __radd__(self, astr):
+        text = PlainText(astr)
+        text += self
+        return text
+    
+    def __copy__(self):
+        text = PlainText()
+        text += self
+        return text
+    
+    def rjust(self, length):
+        return self + " " * (length - self._length)
+    
+    def iter_strs(self):
+        stack = [iter(self._parts)]
+        while stack:
+            for part in stack[-1]:
+                if type(part) is list:
+                    stack.append(iter(part))
+                    break
+                yield part
+            else:
+                stack.pop()
+    
+    def segments(self):
+        for part in self.iter_strs():
+            yield SingleText(part)
+    
     def to_str(self, colorizer=None):
-        return "".join(text.to_str(colorizer) for text in self._subtexts)
+        parts = self._parts
+        if all(type(part) is str for part in parts):
+            return "".join(parts)
+        return "".join(self.iter_strs())
     
     def __len__(self):
-        return sum(map(len, self._subtexts))
+        return self._length
+
+
+def iter_chunks(texts, renderer, chunk_size):
+    '''
+    Render Text (or plain str) chunks and regroup them
+    into str of about chunk_size
+    '''
+    buf = []
+    size = 0
+    for text in texts:
+        s = renderer(text)
+        buf.append(s)
+        size += len(s)
+        if size >= chunk_size:
+            yield "".join(buf)
+            buf = []
+            size = 0
+    buf.append(renderer.close())
+    s = "".join(buf)
+    if s:
+        yield s
+
+
+class FormatBudget:
+    '''
+    Counters for the max_nodes and max_output_chars options,
+    shared by a context and the contexts derived from it.
+    counted is the chunk last counted for max_output_chars while it is
+    passed up through the nodes containing it, so that they don't count
+    it again (see FormatContext.iter_counted).
+    '''
+    __slots__ = ('nodes', 'output_chars', 'max_nodes', 'max_output_chars', 'counted')
+    
+    def __init__(self, max_nodes=None, max_output_chars=None):
+        self.nodes = 0
+        self.output_chars = 0
+        self.max_nodes = max_nodes
+        self.max_output_chars = max_output_chars
+        self.counted = None
+    
+    def limited(self):
+        return self.max_nodes is not None or self.max_output_chars is not None
+    
+    def remaining_nodes(self):
+        if self.max_nodes is None:
+            return None
+        return max(self.max_nodes - self.nodes, 0)
+    
+    def remaining_output_chars(self):
+        if self.max_output_chars is None:
+            return None
+        return max(self.max_output_chars - self.output_chars, 0)
+    
+    def exhausted(self):
+        return (
+            (self.max_nodes is not None and self.nodes >= self.max_nodes) or
+            (self.max_output_chars is not None
+                and self.output_chars >= self.max_output_chars))
+
+
+class FormatMemo:
+    '''
+    Bounded LRU cache of formatted immutable leaves: str, bytes, int, bool,
+    None and flat tuples of those.  Entries are keyed by type, value,
+    FormatState and Text type, so a memo is only valid for one set of
+    options otherwise.  The memo is not used under max_nodes or
+    max_output_chars.
+    str and bytes longer than MAX_STR_LENGTH are not memoized: their key
+    would be hashed over the whole value, and kept alive by the memo.
+    
+    hits and misses count lookups of memoizable objects.
+    '''
+    LEAF_TYPES = frozenset([str, bytes, int, bool, type(None)])
+    STR_TYPES = frozenset([str, bytes])
+    MAX_STR_LENGTH = 256
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._texts = OrderedDict()
+    
+    def key(self, obj, state, text_type):
+        '''
+        Return the memo key for obj formatted in state as text_type,
+        or None if obj is not memoized.
+        '''
+        atype = type(obj)
+        if atype in self.LEAF_TYPES:
+            if atype in self.STR_TYPES and len(obj) > self.MAX_STR_LENGTH:
+                return None
+            return (atype, obj, state, text_type)
+        if atype is tuple:
+            types = tuple(map(type, obj))
+            if self.LEAF_TYPES.issuperset(types) and not any(
+                    t in self.STR_TYPES and len(item) > self.MAX_STR_LENGTH
+                    for t, item in zip(types, obj)):
+                return (atype, obj, types, state, text_type)
+        return None
+    
+    def get(self, key):
+        '''
+        Return a copy of the Text stored for key, or None
+        '''
+        text = self._texts.get(key)
+        if text is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._texts.move_to_end(key)
+        # A copy, since callers may add to the text they get
+        return text.__copy__()
+    
+    def put(self, key, text):
+        self._texts[key] = text.__copy__()
+        if len(self._texts) > self.maxsize:
+            self._texts.popitem(last=False)
+    
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._texts)}
+
+
+def make_memo(memo):
+    '''
+    FormatMemo for the memo option: None or False for no memo,
+    True or a size for a new memo, or a FormatMemo to use as is.
+    '''
+    if memo is None or memo is False:
+        return None
+    if memo is True:
+        return FormatMemo()
+    if isinstance(memo, int):
+        return FormatMemo(memo)
+    return memo
+
+
+class FormatProfile:
+    '''
+    Statistics of the formatting, for the profile option:
+    per formatter, the number of calls and the time spent in the formatter
+    itself (tottime) and including the objects inside (cumtime);
+    per type, the number of objects formatted;
+    and for the output, the number of Text segments and characters.
+    
+    The time of a streamed formatter includes the time the consumer
+    spends on its chunks, such as writing them to the stream.
+    
+    Statistics add up over the calls formatted with the same profile.
+    callback, if given, is called with the profile after each call.
+    '''
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.calls = 0
+        self.segments = 0
+        self.output_chars = 0
+        # formatter name -> [calls, tottime, cumtime]
+        self.formatters = {}
+        # type name -> objects
+        self.types = {}
+        # [formatter name, start, time in nested objects] of each object being formatted
+        self._stack = []
+        self._active = defaultdict(int)
+    
+    def enter(self, formatter, obj):
+        type_name = qualified_name(type(obj))
+        self.types[type_name] = self.types.get(type_name, 0) + 1
+        name = getattr(formatter, "__name__", None) or type(formatter).__name__
+        self._active[name] += 1
+        self._stack.append([name, perf_counter(), 0.0])
+    
+    def exit(self):
+        name, start, nested = self._stack.pop()
+        elapsed = perf_counter() - start
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        stats = self.formatters.get(name)
+        if stats is None:
+            stats = self.formatters[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed - nested
+        self._active[name] -= 1
+        # Only the outermost of nested calls of a formatter counts in cumtime
+        if not self._active[name]:
+            stats[2] += elapsed
+    
+    def format(self, context, obj, formatter):
+        self.enter(formatter, obj)
+        try:
+            return context._format(obj)
+        finally:
+            self.exit()
+    
+    def iter_node(self, chunks, obj, formatter):
+        self.enter(formatter, obj)
+        try:
+            yield from chunks
+        finally:
+            self.exit()
+    
+    def iter_texts(self, texts):
+        '''
+        Count the segments of Text (or str) chunks passing through
+        '''
+        for text in texts:
+            if isinstance(text, str):
+                self.segments += 1
+            else:
+                self.segments += sum(1 for _ in text.segments())
+            yield text
+    
+    def iter_output(self, chunks):
+        '''
+        Count the characters of output chunks passing through,
+        then end the call
+        '''
+        for chunk in chunks:
+            self.output_chars += len(chunk)
+            yield chunk
+        self.done()
+    
+    def done(self):
+        '''
+        End a call
+        '''
+        self.calls += 1
+        if self.callback is not None:
+            self.callback(self)
+    
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "formatters": {
+                name: {"calls": calls, "tottime": tottime, "cumtime": cumtime}
+                for name, (calls, tottime, cumtime) in self.formatters.items()},
+            "types": dict(self.types),
+            "segments": self.segments,
+            "output_chars": self.output_chars,
+        }
+    
+    def report(self):
+        '''
+        The statistics as a table, formatters sorted by tottime
+        '''
+        lines = ["{} calls, {} segments, {} output chars".format(
+            self.calls, self.segments, self.output_chars)]
+        lines.append("{:>10} {:>10} {:>10}  formatter".format("calls", "tottime", "cumtime"))
+        for name, (calls, tottime, cumtime) in sorted(
+                self.formatters.items(), key=lambda item: -item[1][1]):
+            lines.append("{:>10} {:>10.6f} {:>10.6f}  {}".format(calls, tottime, cumtime, name))
+        lines.append("{:>10}  type".format("objects"))
+        for type_name, count in sorted(self.types.items(), key=lambda item: -item[1]):
+            lines.append("{:>10}  {}".format(count, type_name))
+        return "\n".join(lines)
+
+
+def qualified_name(atype):
+    '''
+    Name of atype, prefixed with its module unless it is a built-in
+    '''
+    if atype.__module__ == "builtins":
+        return atype.__qualname__
+    return atype.__module__ + "." + atype.__qualname__
+
+
+def json_value(value):
+    '''
+    JSON for a str, int, float, bool or None
+    '''
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, str):
+        from json.encoder import encode_basestring_ascii
+        return encode_basestring_ascii(value)
+    if isinstance(value, float):
+        return float.__repr__(value)
+    return int.__repr__(value)
+
+
+def print_report(profile):
+    print(profile.report(), file=sys.stderr)
+
+
+def make_profile(profile):
+    '''
+    FormatProfile for the profile option: None or False for no profile,
+    True for a new profile printing its report to stderr after each call,
+    a callable for a new profile calling it after each call,
+    or a FormatProfile to use as is.
+    '''
+    if profile is None or profile is False:
+        return None
+    if profile is True:
+        return FormatProfile(print_report)
+    if isinstance(profile, FormatProfile):
+        return profile
+    return FormatProfile(profile)
+
+
+class SharedRefs:
+    '''
+    Labels of the containers reachable more than once from the formatted
+    object, for the shared_refs option.
+    
+    A shared container is formatted in full the first time it is met,
+    prefixed with "&N", and as the back-reference "*N" afterwards.
+    Built-in containers (and their subclasses) are scanned, and so are
+    the objects formatted by their fields (see has_instance_fields).
+    '''
+    CONTAINER_TYPES = (list, tuple, dict, set, frozenset)
+    
+    __slots__ = ('_shared', '_labels', 'scanned')
+    
+    def __init__(self):
+        self._shared = set()
+        self._labels = {}
+        self.scanned = False
+    
+    def scan(self, obj):
+        '''
+        Find the containers reachable from obj more than once.
+        Each container is visited once, so this is linear in the number
+        of distinct objects.  Empty containers are not labelled.
+        '''
+        from .formatter import has_instance_fields, InstanceFields
+        container_types = self.CONTAINER_TYPES
+        # type -> has_instance_fields(type), for this scan
+        instance_types = {}
+        seen = set()
+        shared = self._shared
+        stack = [obj]
+        while stack:
+            o = stack.pop()
+            if isinstance(o, container_types):
+                # Dict keys are formatted in full, see FormatContext.shared_ref
+                items = o.values() if isinstance(o, dict) else o
+            else:
+                atype = type(o)
+                is_instance = instance_types.get(atype)
+                if is_instance is None:
+                    is_instance = instance_types[atype] = has_instance_fields(atype)
+                if not is_instance:
+                    continue
+                fields = InstanceFields(o)
+                items = [fields[name] for name in fields]
+            if not items:
+                continue
+            obj_id = id(o)
+            if obj_id in seen:
+                shared.add(obj_id)
+                continue
+            seen.add(obj_id)
+            stack.extend(items)
+        self.scanned = True
+    
+    def __contains__(self, obj_id):
+        return obj_id in self._shared
+    
+    def label(self, obj_id):
+        '''
+        Return (label, first): the label of a shared container,
+        and whether this is its first occurrence.
+        '''
+        label = self._labels.get(obj_id)
+        if label is not None:
+            return label, False
+        label = self._labels[obj_id] = len(self._labels) + 1
+        return label, True
+    
+    def mark(self):
+        return len(self._labels)
+    
+    def rewind(self, mark):
+        '''
+        Forget the labels given since mark
+        '''
+        # Labels are given in insertion order
+        while len(self._labels) > mark:
+            self._labels.popitem()
+
+
+class Descend:
+    '''
+    Chunk standing for the chunks of obj formatted in context.
+    Yielded by FormatContext.iter_format under the iterative engine,
+    and replaced by the FormatEngine driving the formatting.
+    '''
+    __slots__ = ('context', 'obj')
+    
+    def __init__(self, context, obj):
+        self.context = context
+        self.obj = obj
+
+
+class FormatEngine:
+    '''
+    Walks formatter output with an explicit stack instead of recursion.
+    
+    While the engine drives, FormatContext.iter_format yields a Descend
+    chunk for each child instead of formatting it; the chunk bubbles up
+    through the formatter generators to the engine, which pushes the
+    child's chunks on its stack.  The output is identical to the
+    recursive engine but the Python stack depth stays constant.
+    '''
+    __slots__ = ('mode', 'threshold', 'driving')
+    
+    def __init__(self, mode="auto", threshold=4):
+        if mode not in ("auto", "recursive", "iterative"):
+            raise ValueError(
+                "engine must be 'auto', 'recursive' or 'iterative', not {!r}".format(mode))
+        self.mode = mode
+        self.threshold = threshold
+        self.driving = 0
+    
+    def must_drive(self, depth):
+        '''
+        True if formatting at depth should start driving iteratively
+        '''
+        if self.mode == "iterative":
+            return True
+        return self.mode == "auto" and depth >= self.threshold
+    
+    def drive(self, chunks, activate=True):
+        '''
+        Iterate chunks, replacing Descend chunks by the chunks they stand for.
+        If activate is true, iter_format yields Descend chunks meanwhile.
+        '''
+        if activate:
+            self.driving += 1
+        stack = [iter(chunks)]
+        try:
+            while stack:
+                for chunk in stack[-1]:
+                    if type(chunk) is Descend:
+                        stack.append(chunk.context.iter_node(chunk.obj))
+                        break
+                    yield chunk
+                else:
+                    stack.pop()
+        finally:
+            # If closed early, close the nested generators innermost first,
+            # so that they leave the call stack in order
+            for chunks in reversed(stack):
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+            if activate:
+                self.driving -= 1
+
+
+class Deferred:
+    '''
+    Chunk standing for the index-th object recorded by DeferredJobs,
+    to be formatted later, possibly in another process.
+    '''
+    __slots__ = ('index',)
+    
+    def __init__(self, index):
+        self.index = index
+
+
+class DeferredJobs:
+    '''
+    Objects met at depth by FormatContext.iter_format, recorded
+    instead of formatted, with the state to format them in later:
+    each job is (obj, FormatState, CallStack snapshot).
+    '''
+    __slots__ = ('depth', 'jobs')
+    
+    def __init__(self, depth):
+        self.depth = depth
+        self.jobs = []
+    
+    def add(self, context, obj):
+        self.jobs.append((obj, context._state, context._callstack.snapshot()))
+        return Deferred(len(self.jobs) - 1)
+
+
+class CallStack:
+    '''
+    Ids of the objects being formatted, with O(1) membership test,
+    and the current nesting depth.
+    '''
+    __slots__ = ('_ids', 'depth')
+    
+    def __init__(self):
+        self._ids = set()
+        self.depth = 0
+    
+    def __contains__(self, obj_id):
+        return obj_id in self._ids
+    
+    def push(self, obj_id):
+        '''
+        Enter an object; return whether its id was added
+        (False if the object is already being formatted).
+        '''
+        self.depth += 1
+        if obj_id in self._ids:
+            return False
+        self._ids.add(obj_id)
+        return True
+    
+    def pop(self, obj_id, pushed):
+        self.depth -= 1
+        if pushed:
+            self._ids.discard(obj_id)
+    
+    def snapshot(self):
+        return (frozenset(self._ids), self.depth)
+    
+    def restore(self, snapshot):
+        ids, self.depth = snapshot
+        self._ids = set(ids)
+
+
+class FormatState(namedtuple("FormatState", "indentation key_context multiline column")):
+    '''
+    Immutable per-level state of a FormatContext.
+    column is where the object starts on its line, if known to be
+    after the indentation; it is only tracked with the width option.
+    '''
+    __slots__ = ()
 
 
 class FormatContext(metaclass=ABCMeta):
+    '''
+    Formatting state passed to formatters.
+    
+    A context is made of per-call objects shared by all contexts of a call
+    (options, call stack, budget, engine) and an immutable FormatState.
+    Contexts for other states (indented(), key_context(), ...) are created
+    once per state and call, then reused.
+    A context is its own context manager, so that
+    "with context.indented() as ctx:" costs no copy.
+    '''
     @abstractmethod
     def get_formatter(self, obj):
         pass
     
     def __init__(self, options):
-        self._indentation = 0
         self._options = options
-        self._callstack = []
-        self._key_context = False
+        # jsonl documents are a single line
+        multiline = options.get("multiline", True) and options.get("doctype") != "jsonl"
+        self._state = FormatState(0, False, multiline, 0)
+        self._contexts = {self._state: self}
+        self._callstack = CallStack()
+        self._budget = FormatBudget(
+            options.get("max_nodes"), options.get("max_output_chars"))
+        self._engine = FormatEngine(
+            options.get("engine", "auto"), options.get("iterative_depth", 4))
+        # Under a budget, texts may be cut short, and memoized texts
+        # would not count their items: the memo is not used
+        if self._budget.limited():
+            self._memo = None
+        else:
+            self._memo = make_memo(options.get("memo"))
+        self._refs = SharedRefs() if options.get("shared_refs") else None
+        self._deferred = None
+        self._profile = make_profile(options.get("profile"))
+        self._peeked = {}
+        self._text_type = options.text_type()
+        self._json = options.get("doctype", "text") != "text"
+        if self._json:
+            from .formatter import json_leaf_fields
+            self._json_leaf_fields = json_leaf_fields
+            # state -> text_context() for this call
+            self._text_contexts = {}
+        if self._text_type is PlainText:
+            self._endl, self._space = "\n", " "
+        else:
+            self._endl, self._space = SingleText("\n"), SingleText(" ")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
     
     def format(self, obj):
+        if self._budget.max_output_chars is not None:
+            # Counted chunk by chunk, as when streaming
+            return self.join(self.iter_node(obj))
+        profile = self._profile
+        if profile is not None:
+            formatter = self.get_formatter(obj, id(obj) in self._callstack)
+            return profile.format(self, obj, formatter)
+        return self._format(obj)
+    
+    def format_label(self, obj):
+        '''
+        Format obj as a label, like a dict key or a list index: it is
+        not charged to the max_nodes budget, which counts the items shown,
+        not their labels.  Its characters count for max_output_chars when
+        the text it is part of is written, not when it is formatted.
+        '''
+        budget = self._budget
+        nodes, output_chars = budget.nodes, budget.output_chars
+        try:
+            return self.format(obj)
+        finally:
+            budget.nodes, budget.output_chars = nodes, output_chars
+    
+    def iter_label(self, obj):
+        '''
+        Chunks of obj formatted as a label, like format_label, for the
+        JSON doctypes: the nodes are given back once obj is formatted.
+        The chunks count for max_output_chars as they are written.
+        '''
+        budget = self._budget
+        nodes = budget.nodes
+        try:
+            yield from self.iter_format(obj)
+        finally:
+            budget.nodes = nodes
+    
+    def enter_node(self, obj):
+        '''
+        Return (recursive, formatter) for obj, counting it as one node
+        for the max_nodes option.  Objects formatted at once (format)
+        and streamed (iter_format) are counted here alike.
+        '''
         recursive = (id(obj) in self._callstack)
-        self._callstack.append(id(obj))
+        formatter = self.get_formatter(obj, recursive)
+        self._budget.nodes += 1
+        return recursive, formatter
+    
+    def iter_counted(self, chunks):
+        '''
+        Pass chunks through, counting for the max_output_chars option
+        those which no node inside has counted yet: each character written
+        counts once, brackets, separators and indentation included.
+        '''
+        budget = self._budget
+        for chunk in chunks:
+            if chunk is not budget.counted and type(chunk) is not Descend:
+                budget.output_chars += len(chunk)
+                budget.counted = chunk
+            yield chunk
+            # The next chunk is a new one, even if it is the same object
+            budget.counted = None
+    
+    def _format(self, obj):
+        obj_id = id(obj)
+        recursive, formatter = self.enter_node(obj)
+        if self.must_elide(formatter):
+            return formatter.format_elided(obj, self)
+        if self._refs is not None and not recursive:
+            ref = self.shared_ref(obj)
+            if ref is not None:
+                text, first = ref
+                if not first:
+                    return text
+                pushed = self._callstack.push(obj_id)
+                try:
+                    return text + formatter(obj, self)
+                finally:
+                    self._callstack.pop(obj_id, pushed)
+        if self._memo is not None:
+            key = self._memo.key(obj, self._state, self._text_type)
+            if key is not None:
+                return self.format_memoized(obj, formatter, key)
+        pushed = self._callstack.push(obj_id)
         try:
-            return self.get_formatter(obj, recursive)(obj, self)
+            return formatter(obj, self)
         finally:
-            self._callstack.pop(-1)
+            self._callstack.pop(obj_id, pushed)
     
-    def text(self, string=None, color=None):
-        text = ComplexText()
-        if string is not None:
-            text += SingleText(string, color)
+    def format_memoized(self, obj, formatter, key):
+        text = self._memo.get(key)
+        if text is None:
+            text = formatter(obj, self)
+            self._memo.put(key, text)
+        return text
+    
+    def iter_format(self, obj):
+        '''
+        Format obj as a sequence of Text chunks.
+        Formatters which define iter_text are streamed chunk by chunk,
+        others are called and yield a single chunk.
+        
+        Formatters must pass the chunks through unchanged (yield from)
+        or give them to join(), since under the iterative engine they
+        may include Descend chunks.
+        '''
+        deferred = self._deferred
+        if deferred is not None and self._callstack.depth == deferred.depth:
+            yield deferred.add(self, obj)
+            return
+        engine = self._engine
+        if engine.driving:
+            yield Descend(self, obj)
+        elif engine.must_drive(self._callstack.depth):
+            yield from engine.drive(self.iter_node(obj))
+        else:
+            yield from self.iter_node(obj)
+    
+    def iter_node(self, obj):
+        '''
+        Chunks of obj formatted by its formatter.
+        Each call counts as one node for the max_nodes option, and
+        the chunks count for max_output_chars (see iter_counted).
+        '''
+        if self._json:
+            chunks = self._iter_json_node(obj)
+        else:
+            chunks = self._iter_node(obj)
+        if self._budget.max_output_chars is not None:
+            chunks = self.iter_counted(chunks)
+        profile = self._profile
+        if profile is not None:
+            formatter = self.get_formatter(obj, id(obj) in self._callstack)
+            return profile.iter_node(chunks, obj, formatter)
+        return chunks
+    
+    def _iter_node(self, obj):
+        obj_id = id(obj)
+        recursive, formatter = self.enter_node(obj)
+        if self.must_elide(formatter):
+            yield formatter.format_elided(obj, self)
+            return
+        if self._refs is not None and not recursive:
+            ref = self.shared_ref(obj)
+            if ref is not None:
+                text, first = ref
+                yield text
+                if not first:
+                    return
+        if self._memo is not None:
+            key = self._memo.key(obj, self._state, self._text_type)
+            if key is not None:
+                yield self.format_memoized(obj, formatter, key)
+                return
+        pushed = self._callstack.push(obj_id)
+        try:
+            iter_text = getattr(formatter, "iter_text", None)
+            if iter_text is None:
+                yield formatter(obj, self)
+            else:
+                yield from iter_text(obj, self)
+        finally:
+            self._callstack.pop(obj_id, pushed)
+    
+    def _iter_json_node(self, obj):
+        '''
+        Chunks of the JSON object for obj, for the "json" and "jsonl"
+        doctypes: its type, id and the fields given by the json_fields
+        method of its formatter, then the items yielded by the
+        iter_json_items method, if any, as an "items" array.
+        Formatters without json_fields are taken as leaves.
+        '''
+        obj_id = id(obj)
+        recursive, formatter = self.enter_node(obj)
+        head = '{"type": ' + json_value(qualified_name(type(obj))) + ', "id": ' + str(obj_id)
+        if recursive:
+            yield head + ', "recursion": true}'
+            return
+        json_fields = getattr(formatter, "json_fields", None)
+        if self.must_elide(formatter):
+            fields = json_fields(obj, self) if json_fields is not None else {}
+            yield head + self.json_fields(fields) + ', "elided": true}'
+            return
+        refs = self._refs
+        if refs is not None:
+            if not refs.scanned:
+                refs.scan(obj)
+            if obj_id in refs:
+                label, first = refs.label(obj_id)
+                if not first:
+                    yield head + ', "ref": ' + str(label) + "}"
+                    return
+                head += ', "label": ' + str(label)
+        pushed = self._callstack.push(obj_id)
+        try:
+            if json_fields is None:
+                fields = self._json_leaf_fields(obj, formatter, self)
+            else:
+                fields = json_fields(obj, self)
+            head += self.json_fields(fields)
+            iter_items = getattr(formatter, "iter_json_items", None)
+            items = iter_items(obj, self) if iter_items is not None else None
+            if items is None:
+                yield head + "}"
+                return
+            yield head + ', "items": ['
+            empty = True
+            for chunk in items:
+                empty = False
+                yield chunk
+            if empty or not self._state.multiline:
+                yield "]}"
+            else:
+                yield "\n" + self.indent() + "]}"
+        finally:
+            self._callstack.pop(obj_id, pushed)
+    
+    def json_fields(self, fields):
+        '''
+        JSON members for a dict of str, int, float, bool or None values
+        '''
+        return "".join(
+            ", " + json_value(key) + ": " + json_value(value)
+            for key, value in fields.items())
+    
+    def json_separator(self, first):
+        '''
+        The separator before an item of a JSON array of an indented context:
+        items are on their own lines, unless for the "jsonl" doctype
+        '''
+        if not self._state.multiline:
+            return "" if first else ", "
+        return ("\n" if first else ",\n") + self.indent()
+    
+    def shared_ref(self, obj):
+        '''
+        For the shared_refs option: return (text, first) if obj is a shared
+        container, where text is its label "&N " on the first occurrence
+        and the back-reference "*N" afterwards; return None otherwise.
+        Keys are always formatted in full.
+        '''
+        refs = self._refs
+        if not refs.scanned:
+            # The first object formatted is the root of the call
+            refs.scan(obj)
+        obj_id = id(obj)
+        if obj_id not in refs or self._state.key_context:
+            return None
+        label, first = refs.label(obj_id)
+        if first:
+            return self.text("&{0} ".format(label), "ref"), True
+        return self.text("*{0}".format(label), "ref"), False
+    
+    def defer(self, depth):
+        '''
+        Record the objects iter_format meets at depth instead of formatting
+        them; they are replaced by Deferred chunks.  Return the DeferredJobs.
+        Must be called before formatting with this context.
+        '''
+        self._deferred = DeferredJobs(depth)
+        return self._deferred
+    
+    def resume(self, snapshot):
+        '''
+        Restore the call stack of a deferred job, so that it formats
+        as it would have at its place
+        '''
+        self._callstack.restore(snapshot)
+    
+    def profile(self):
+        '''
+        The FormatProfile of this call, or None if not profiling
+        '''
+        return self._profile
+    
+    def must_elide(self, formatter):
+        '''
+        True if the object formatted by formatter must be replaced by
+        a placeholder because it is nested deeper than the max_depth option
+        or the budget is exhausted.
+        Only formatters with a format_elided method (containers) are elided.
+        '''
+        if not hasattr(formatter, "format_elided"):
+            return False
+        max_depth = self._options.get("max_depth")
+        if max_depth is not None and self._callstack.depth >= max_depth:
+            return True
+        return self._budget.exhausted()
+    
+    def exhausted(self):
+        '''
+        True if the max_nodes or max_output_chars budget is used up.
+        Container formatters stop iterating their items then.
+        '''
+        return self._budget.exhausted()
+    
+    def remaining_nodes(self):
+        '''
+        Number of nodes left in the max_nodes budget, or None if unlimited
+        '''
+        return self._budget.remaining_nodes()
+    
+    def remaining_output_chars(self):
+        '''
+        Number of characters left in the max_output_chars budget,
+        or None if unlimited
+        '''
+        return self._budget.remaining_output_chars()
+    
+    def join(self, texts):
+        '''
+        Concatenate Text chunks into one Text
+        '''
+        text = self.text()
+        for t in self._engine.drive(texts, activate=False):
+            text += t
         return text
     
+    def text(self, string=None, color=None):
+        if string is None:
+            return self._text_type()
+        return self._text_type(string, color)
+    
     def endl(self):
-        return SingleText("\n")
+        return self._endl
     
     def space(self):
-        return SingleText(' ')
+        return self._space
     
     def one_indent(self):
         return " " * self._options["indent"]
     
     def indent(self):
-        return " " * self._indentation
+        return " " * self._state.indentation
     
     def outdent(self):
-        return ' ' * self._indentation
+        return ' ' * self._state.indentation
     
     def limit_str_length(self):
-        return 32
+        return self._options.get("max_str_length", 32)
     
     def limit(self):
         return self._options["limit"]
@@ -261,35 +1496,134 @@ class FormatContext(metaclass=ABCMeta):
     def show_list_index(self):
         return True
     
+    def peek(self):
+        '''
+        Number of items taken from iterators to show them
+        '''
+        return self._options.get("peek", 0)
+    
+    def peeked(self, iterator, peek):
+        '''
+        Return peek(iterator), the items taken from iterator, once per call:
+        an iterator formatted again (as after a try to fit its container
+        on a line) shows the same items.  The result must keep a reference
+        to iterator, so that its id is not reused during the call.
+        '''
+        key = id(iterator)
+        try:
+            return self._peeked[key]
+        except KeyError:
+            items = self._peeked[key] = peek(iterator)
+            return items
+    
     def sort_keys(self):
-        return True
+        '''
+        Order of dict keys and set items: "sorted", "insertion"
+        or a key function to sort them with
+        '''
+        return self._options.get("sort_keys", "sorted")
+    
+    def derived(self, state):
+        '''
+        Return the context of this call with the given FormatState
+        '''
+        try:
+            return self._contexts[state]
+        except KeyError:
+            c = object.__new__(type(self))
+            c.__dict__.update(self.__dict__)
+            c._state = state
+            self._contexts[state] = c
+            return c
+    
+    def text_context(self):
+        '''
+        Return the context of this call and state for the "text" doctype,
+        in which the JSON doctypes format the repr of their leaves
+        '''
+        if not self._json:
+            return self
+        try:
+            return self._text_contexts[self._state]
+        except KeyError:
+            c = object.__new__(type(self))
+            c.__dict__.update(self.__dict__)
+            c._json = False
+            c._contexts = self._text_contexts
+            # The memo would mix texts with the JSON of the same objects
+            c._memo = None
+            self._text_contexts[self._state] = c
+            return c
     
-    @contextmanager
     def indented(self):
-        c = copy(self)
-        c._indentation += self._options["indent"]
-        yield c
+        indentation, key_context, multiline, column = self._state
+        return self.derived(FormatState(
+            indentation + self._options["indent"], key_context, multiline, 0))
     
-    @contextmanager
     def unindented(self):
-        c = copy(self)
-        c._indentation -= self._options["indent"]
-        yield c
+        indentation, key_context, multiline, column = self._state
+        return self.derived(FormatState(
+            indentation - self._options["indent"], key_context, multiline, 0))
     
-    @contextmanager
     def key_context(self):
-        c = copy(self)
-        c._key_context = True
-        yield c
+        indentation, key_context, multiline, column = self._state
+        return self.derived(FormatState(indentation, True, multiline, column))
     
-    @contextmanager
     def singleline(self):
-        c = copy(self)
-        c._options["multiline"] = False
-        yield c
+        indentation, key_context, multiline, column = self._state
+        return self.derived(FormatState(indentation, key_context, False, column))
+    
+    def at_column(self, column):
+        '''
+        Context for an object starting at column of its line,
+        e.g. after the index of a list item
+        '''
+        if self._options.get("width") is None:
+            return self
+        indentation, key_context, multiline, _ = self._state
+        return self.derived(FormatState(indentation, key_context, multiline, column))
+    
+    def must_fit(self):
+        '''
+        True if containers should try to fit on one line (the width option)
+        '''
+        return self._state.multiline and self._options.get("width") is not None
+    
+    def fit_on_line(self, chunks):
+        '''
+        Join chunks if they fit in the width left on the line, or return
+        None as soon as they exceed it: at most the width is formatted
+        in vain.  The budget and shared references are restored then.
+        The characters of the text count for max_output_chars when it is
+        written, as a single chunk.
+        Chunks must be formatted in a singleline() context.
+        '''
+        available = self._options["width"] - max(self._state.column, self._state.indentation)
+        budget = self._budget
+        nodes, output_chars = budget.nodes, budget.output_chars
+        labels = self._refs.mark() if self._refs is not None else None
+        text = self.text()
+        chunks = self._engine.drive(chunks, activate=False)
+        try:
+            for t in chunks:
+                text += t
+                if len(text) > available:
+                    break
+            else:
+                budget.output_chars = output_chars
+                return text
+        finally:
+            chunks.close()
+        budget.nodes, budget.output_chars = nodes, output_chars
+        if labels is not None:
+            self._refs.rewind(labels)
+        return None
     
     def is_in_key_context(self):
-        return self._key_context
+        return self._state.key_context
+    
+    def is_multiline(self):
+        return self._state.multiline
 
 
 class IsInstance:
@@ -303,28 +1637,152 @@ class IsInstance:
     
     def __call__(self, object):
         return isinstance(object, self._type)
+    
+    def match_type(self, atype):
+        '''
+        Return how specific the match is for instances of atype:
+        the position of the registered type in atype's MRO
+        (len(MRO) for virtual subclasses), or None if not matched.
+        '''
+        if not issubclass(atype, self._type):
+            return None
+        mro = atype.__mro__
+        try:
+            return mro.index(self._type)
+        except ValueError:
+            return len(mro)
+
+
+class IsInstanceByName:
+    """
+    Like IsInstance, but the type is given by its module and qualified name,
+    e.g. "numpy.ndarray", so that its module needs not be imported:
+    if it was not imported, no object can be an instance of the type.
+    """
+    def __init__(self, type_name):
+        module, _, qualname = type_name.rpartition(".")
+        assert module and qualname
+        self._module = module
+        self._qualname = qualname
+    
+    def __call__(self, object):
+        return self.match_type(type(object)) is not None
+    
+    def match_type(self, atype):
+        '''
+        Return the position of the named type in atype's MRO, or None
+        '''
+        for index, klass in enumerate(atype.__mro__):
+            if (klass.__qualname__ == self._qualname
+                    and klass.__module__ == self._module):
+                return index
+        return None
+
+
+class TypeMatches:
+    """
+    Matches the instances of the types for which predicate(type) is true.
+    Unlike a predicate on objects, the match is memoized per type.
+    """
+    def __init__(self, predicate):
+        self._predicate = predicate
+    
+    def __call__(self, object):
+        return self.match_type(type(object)) is not None
+    
+    def match_type(self, atype):
+        '''
+        Return len(MRO) if atype is matched, or None: the match ranks
+        behind the registrations of atype and of its base classes
+        '''
+        return len(atype.__mro__) if self._predicate(atype) else None
 
 
 class FormatContextWithFormatters(FormatContext):
-    def __init__(self, formatters, format_object, format_recursive_object, options):
+    '''
+    FormatContext which chooses a formatter from registrations.
+    
+    The registration with the highest priority wins.  Among registrations
+    of the same priority, a type registered nearer in the MRO of the object
+    wins, then the one registered last (so a type can be re-registered to
+    override its formatter).  Predicate registrations come after type
+    registrations, and type predicates (TypeMatches) after both: they stand
+    in for the classes which have no formatter of their own.
+    Type registrations are resolved once per type and memoized
+    in dispatch_cache, a WeakKeyDictionary shared by the calls of a builder,
+    so that formatted classes can still be collected; each call keeps the
+    types it meets in a dict of its own, which is faster to look up.
+    Predicate registrations are evaluated for each object.
+    '''
+    def __init__(self, formatters, format_object, format_recursive_object, options,
+            dispatch_cache=None):
         FormatContext.__init__(self, options)
         self._formatters = formatters
         self._format_object = format_object
         self._format_recursive_object = format_recursive_object 
+        self._type_formatters = [
+            reg for reg in formatters if hasattr(reg.match, "match_type")]
+        self._predicate_formatters = [
+            reg for reg in formatters if not hasattr(reg.match, "match_type")]
+        if dispatch_cache is None:
+            dispatch_cache = WeakKeyDictionary()
+        self._dispatch_cache = dispatch_cache
+        # type -> (registration, recursive registration) for this call
+        self._call_dispatch = {}
+    
+    def resolve_type(self, atype, recursive):
+        '''
+        Return the type registration to use for instances of atype, or None
+        '''
+        best = None
+        best_rank = None
+        for index, reg in enumerate(self._type_formatters):
+            if bool(reg.recursive) != recursive:
+                continue
+            distance = reg.match.match_type(atype)
+            if distance is None:
+                continue
+            rank = (reg.priority, -distance, index)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = reg, rank
+        return best
+    
+    def resolve_types(self, atype):
+        '''
+        Return the type registrations for atype, (not recursive, recursive),
+        memoized in dispatch_cache
+        '''
+        regs = self._dispatch_cache.get(atype)
+        if regs is None:
+            regs = (self.resolve_type(atype, False), self.resolve_type(atype, True))
+            self._dispatch_cache[atype] = regs
+        self._call_dispatch[atype] = regs
+        return regs
     
     def get_formatter(self, obj, recursive=False):
-        matched_formatters = [
-            reg for reg in self._formatters
-                if reg.match(obj) and bool(reg.recursive) == bool(recursive)]
+        recursive = bool(recursive)
+        atype = type(obj)
+        try:
+            reg = self._call_dispatch[atype][recursive]
+        except KeyError:
+            reg = self.resolve_types(atype)[recursive]
         
-        if not matched_formatters:
+        for pred_reg in self._predicate_formatters:
+            if bool(pred_reg.recursive) != recursive:
+                continue
+            if reg is not None and (pred_reg.priority < reg.priority
+                    or pred_reg.priority == reg.priority
+                    and not isinstance(reg.match, TypeMatches)):
+                continue
+            if pred_reg.match(obj):
+                reg = pred_reg
+        
+        if reg is None:
             if recursive:
                 return self._format_recursive_object
             else:
                 return self._format_object
-        
-        matched_formatters.sort(key=operator.attrgetter("priority"), reverse=True)
-        return matched_formatters[0].formatter
+        return reg.formatter
 
 
 FormatterRegistration = namedtuple("FormatterRegistration", "formatter match recursive priority")
@@ -334,25 +1792,67 @@ class FormatContextBuilder:
         self._formatters = []
         self._format_object = format_object
         self._format_recursive_object = format_recursive_object
+        self._dispatch_cache = WeakKeyDictionary()
     
     def create_format_context(self, *a, **kw):
         return FormatContextWithFormatters(*a, **kw)
     
+    def copy(self):
+        builder = FormatContextBuilder(
+            self._format_object,
+            self._format_recursive_object,
+        )
+        builder._formatters = list(self._formatters)
+        return builder
+    
     def build(self, options):
         return self.create_format_context(
             list(self._formatters),
             self._format_object,
             self._format_recursive_object,
-            options
+            options,
+            dispatch_cache=self._dispatch_cache,
         )
     
-    def add_type_formatter(self, type, formatter, recursive=False, priority=0):
+    def add_formatter(self, match, formatter, recursive=False, priority=0):
+        '''
+        Register formatter for objects for which match(obj) is true.
+        If match has a match_type method (like IsInstance), the choice
+        is memoized per type; otherwise match is called for each object.
+        '''
         self._formatters.append(
             FormatterRegistration(
                 formatter=formatter,
-                match=IsInstance(type),
+                match=match,
                 recursive=recursive,
                 priority=priority
             )
         )
-
+        # Contexts already built keep the cache matching their registrations
+        self._dispatch_cache = WeakKeyDictionary()
+    
+    def add_type_formatter(self, type, formatter, recursive=False, priority=0):
+        '''
+        Register formatter for instances of type.
+        type may also be a name like "numpy.ndarray" (see IsInstanceByName).
+        '''
+        if isinstance(type, str):
+            match = IsInstanceByName(type)
+        else:
+            match = IsInstance(type)
+        self.add_formatter(match, formatter, recursive, priority)
+    
+    def add_type_predicate_formatter(self, predicate, formatter, recursive=False, priority=0):
+        '''
+        Register formatter for instances of the types for which
+        predicate(type) is true (see TypeMatches).
+        The predicate is evaluated once per type.
+        '''
+        self.add_formatter(TypeMatches(predicate), formatter, recursive, priority)
+    
+    def add_predicate_formatter(self, predicate, formatter, recursive=False, priority=0):
+        '''
+        Register formatter for objects for which predicate(obj) is true.
+        The predicate is evaluated for each object, so it is not cached.
+        '''
+        self.add_formatter(predicate, formatter, recursive, priority)
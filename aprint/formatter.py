@@ -1,5 +1,254 @@
 #!python3
 # -*- coding: ascii -*-
+import codecs
+from collections import deque
+import heapq
+from itertools import islice
+from math import (
+    ceil,
+    floor,
+    isfinite
+)
+import sys
+from weakref import WeakKeyDictionary
+
+
+def abbr_range(length, context):
+    '''
+    Return (start, end) such that only items [0, start) and [end, length)
+    are shown, or None if all items are shown.
+    '''
+    limit = context.limit()
+    if limit is None or length <= limit:
+        return None
+    return (int(ceil(limit / 2)), int(length - floor(limit / 2)))
+
+
+def count_items(count, items="items"):
+    '''
+    "1 item", "2 items", ...; items is the plural, like "more items"
+    '''
+    if count == 1:
+        items = items[:-1]
+    return "{} {}".format(count, items)
+
+
+def format_more_items(context, count, color):
+    '''
+    Placeholder line for the items left out when the budget is exhausted
+    '''
+    if not context.is_multiline():
+        return context.text("... " + count_items(count, "more items"), color)
+    with context.indented() as ctx:
+        return ctx.indent() + ctx.text(
+            "[... {}]".format(count_items(count, "more items")), color)
+
+
+def budget_items(context):
+    '''
+    Bound of the number of items that can be shown within the max_nodes
+    and max_output_chars budgets, or None if unlimited: each item costs
+    a node, and a character at least, as its brackets, separator and
+    indentation count too.  Containers select no more than this many
+    items (plus one to tell that the budget runs out), so as not to order
+    or format keys that are never shown.
+    '''
+    bounds = [n for n in (context.remaining_nodes(), context.remaining_output_chars())
+        if n is not None]
+    return min(bounds, default=None)
+
+
+def select_items(items, context, sort_keys):
+    '''
+    Return (head, tail, abbr): the items of a dict or set shown before and
+    after the "..." line in the order of sort_keys, and their abbr_range.
+    Only the items shown within the budget are selected.
+    '''
+    abbr = abbr_range(len(items), context)
+    shown = budget_items(context)
+    if abbr is None:
+        if shown is not None and shown < len(items):
+            head, tail = select_head_tail(items, shown + 1, 0, sort_keys)
+        else:
+            head, tail = sort_items(items, sort_keys), []
+    else:
+        abbr_start, abbr_end = abbr
+        head, tail = select_head_tail(
+            items, abbr_start, len(items) - abbr_end, sort_keys)
+    if shown is not None and shown < len(head):
+        # The budget runs out within head
+        head, tail, abbr = head[:shown + 1], [], None
+    return head, tail, abbr
+
+
+def iter_line_items(context, head, tail, abbr, total, iter_item, color):
+    '''
+    Chunks of the items of a container on one line, separated by commas:
+    the head items, then "..." and the tail items if abbr is not None.
+    iter_item(item) yields the chunks of an item.
+    '''
+    first = True
+    for i, item in enumerate(head):
+        if not first:
+            yield ", "
+        first = False
+        if context.exhausted():
+            yield format_more_items(context, total - i, color)
+            return
+        yield from iter_item(item)
+    if abbr is None:
+        if len(head) < total:
+            # Trimmed to the budget (see budget_items)
+            if not first:
+                yield ", "
+            yield format_more_items(context, total - len(head), color)
+        return
+    if not first:
+        yield ", "
+    yield context.text("...", color)
+    for i, item in enumerate(tail):
+        yield ", "
+        if context.exhausted():
+            yield format_more_items(context, len(tail) - i, color)
+            return
+        yield from iter_item(item)
+
+
+def iter_json_items(context, head, tail, abbr, total, iter_item):
+    '''
+    Chunks of the items of a container in a JSON array: the head items,
+    then {"omitted": count} and the tail items if abbr is not None.
+    iter_item(item, ctx) yields the chunks of an item in the context ctx.
+    '''
+    with context.indented() as ctx:
+        first = True
+        for i, item in enumerate(head):
+            yield ctx.json_separator(first)
+            first = False
+            if context.exhausted():
+                yield '{"omitted": ' + str(total - i) + "}"
+                return
+            yield from iter_item(item, ctx)
+        if abbr is None:
+            if len(head) < total:
+                # Trimmed to the budget (see budget_items)
+                yield ctx.json_separator(first)
+                yield '{"omitted": ' + str(total - len(head)) + "}"
+            return
+        yield ctx.json_separator(first)
+        yield '{"omitted": ' + str(abbr[1] - abbr[0]) + "}"
+        for i, item in enumerate(tail):
+            yield ctx.json_separator(False)
+            if context.exhausted():
+                yield '{"omitted": ' + str(len(tail) - i) + "}"
+                return
+            yield from iter_item(item, ctx)
+
+
+def json_leaf_fields(obj, formatter, context):
+    '''
+    JSON fields of an object whose formatter has no json_fields method:
+    the value of None, bools, ints, finite floats and str,
+    and the formatted text of anything else
+    '''
+    atype = type(obj)
+    if obj is None or atype is bool or atype is int:
+        return {"value": obj}
+    if atype is float and isfinite(obj):
+        return {"value": obj}
+    if atype is str:
+        return format_str.json_fields(obj, context)
+    return {"repr": formatter(obj, context.text_context()).to_str()}
+
+
+# Numbers of these types compare with each other and are ordered together
+NUMBER_TYPES = frozenset([int, float, bool])
+
+
+def type_order(item):
+    '''
+    Sort key ordering items of mixed types: numbers first, then the other
+    items grouped by type name, each group in its natural order.
+    '''
+    atype = type(item)
+    if atype in NUMBER_TYPES:
+        return (0, "", item)
+    return (1, atype.__qualname__, item)
+
+
+def sort_key(items, sort_keys):
+    '''
+    Key function sorting items for the sort_keys option "sorted" or a key
+    function, or None if items can be compared as they are
+    '''
+    if callable(sort_keys):
+        return sort_keys
+    types = set(map(type, items))
+    if len(types) > 1 and not NUMBER_TYPES.issuperset(types):
+        return type_order
+    return None
+
+
+def sort_items(items, sort_keys):
+    '''
+    Return a list of items in the order of the sort_keys option.
+    Items which cannot be ordered are taken in iteration order; the errors
+    of a sort_keys function, or of comparing its keys, are raised.
+    '''
+    items = list(items)
+    if sort_keys == "insertion":
+        return items
+    if callable(sort_keys):
+        items.sort(key=sort_keys)
+        return items
+    try:
+        items.sort(key=sort_key(items, sort_keys))
+    except TypeError:
+        pass
+    return items
+
+
+def select_head_tail(items, head_len, tail_len, sort_keys="sorted"):
+    '''
+    Return lists of the first head_len and the last tail_len items
+    in the order of the sort_keys option, without sorting all of them.
+    Items are ordered as by sort_items.
+    '''
+    if callable(sort_keys):
+        # A key function may tie: ties are broken by position, as the
+        # stable sort does, so that head and tail never share an item
+        def indexed_key(pair):
+            return sort_keys(pair[1]), pair[0]
+        head = heapq.nsmallest(head_len, enumerate(items), key=indexed_key)
+        tail = heapq.nlargest(tail_len, enumerate(items), key=indexed_key)
+        tail.reverse()
+        return [item for i, item in head], [item for i, item in tail]
+    if sort_keys != "insertion":
+        try:
+            key = sort_key(items, sort_keys)
+            head = heapq.nsmallest(head_len, items, key=key)
+            tail = heapq.nlargest(tail_len, items, key=key)
+        except TypeError:
+            pass
+        else:
+            # Distinct keys and set items only tie if they don't compare,
+            # like NaNs, which may land in both head and tail
+            if set(map(id, head)).isdisjoint(map(id, tail)):
+                tail.reverse()
+                return head, tail
+            items = sort_items(items, sort_keys)
+            return items[:head_len], items[len(items) - tail_len:]
+    head = list(islice(items, head_len))
+    if not tail_len:
+        tail = []
+    elif isinstance(items, dict):
+        # Dicts iterate backwards without going through all the keys
+        tail = list(islice(reversed(items), tail_len))
+        tail.reverse()
+    else:
+        tail = list(deque(items, maxlen=tail_len))
+    return head, tail
+
 
 def format_object(obj, context):
     return context.text(str(obj))
@@ -26,37 +275,113 @@ def format_bool(obj, context):
         return context.text(str(obj), color="False")
 
 
+def limit_slices(length, limit, mid_len):
+    '''
+    Return (head_end, tail_start) such that [0, head_end) and
+    [tail_start, length) are shown around mid, in limit characters
+    in all, or None if all of the length characters are shown.
+    '''
+    if not limit or length <= limit:
+        return None
+    head_len = max(limit - mid_len, 0) // 2
+    tail_len = max(limit - mid_len - head_len, 0)
+    return head_len, length - tail_len
+
+
+# Control characters, backslash and line separators
+STR_ESCAPES = {i: "\\x{:02x}".format(i) for i in list(range(0x20)) + list(range(0x7f, 0xa0))}
+STR_ESCAPES.update({
+    ord("\n"): "\\n",
+    ord("\r"): "\\r",
+    ord("\t"): "\\t",
+    ord("\\"): "\\\\",
+    0x2028: "\\u2028",
+    0x2029: "\\u2029",
+})
+
+
+def escape_str(astr):
+    '''
+    Escape control characters and backslashes, so that a str is shown
+    on one line
+    '''
+    # Most strings need no escape: isprintable is much faster than translate
+    if astr.isprintable() and "\\" not in astr:
+        return astr
+    return astr.translate(STR_ESCAPES)
+
+
 class StrFormatter:
+    '''
+    Formats str escaped, and shortened to the max_str_length option.
+    Only the shown head and tail of long strings are escaped.
+    '''
     mid = "..."
     def get_limited(self, astr, context):
-        if context.limit_str_length() and len(astr) > context.limit_str_length() - len(self.mid):
-            head_len = (context.limit_str_length() - len(self.mid)) // 2
-            head = astr[:head_len]
-            tail_len = context.limit_str_length() - len(self.mid) - len(head)
-            tail = astr[-tail_len-1:]
-            return head + self.mid + tail
-        else:
+        slices = limit_slices(len(astr), context.limit_str_length(), len(self.mid))
+        if slices is None:
             return astr
+        head_end, tail_start = slices
+        return astr[:head_end] + self.mid + astr[tail_start:]
+    
+    def escape(self, astr):
+        return escape_str(str(astr))
     
     def format_content(self, astr, context):
-        return str(self.get_limited(astr, context))
+        slices = limit_slices(len(astr), context.limit_str_length(), len(self.mid))
+        if slices is None:
+            return self.escape(astr)
+        head_end, tail_start = slices
+        return self.escape(astr[:head_end]) + self.mid + self.escape(astr[tail_start:])
+    
+    def json_fields(self, astr, context):
+        # Not escaped: JSON encoding escapes what's needed
+        fields = {"value": str(self.get_limited(astr, context)), "len": len(astr)}
+        if limit_slices(len(astr), context.limit_str_length(), len(self.mid)):
+            fields["truncated"] = True
+        return fields
     
     def header(self, astr, context):
-        if type(astr) == str:
+        if type(astr) is str:
             return ""
         else:
             return type(astr).__name__ + " "
     
     def __call__(self, astr, context):
-        s = "{header}'{content}'".format(
-                header=self.header(astr, context),
-                length=len(astr),
-                content=self.format_content(astr, context))
+        s = self.header(astr, context) + "'" + self.format_content(astr, context) + "'"
+        return context.text(s, "str")
+
+format_str = StrFormatter()
+
+
+class BytesFormatter(StrFormatter):
+    '''
+    Formats bytes and bytearray like str, escaping only the shown slices
+    '''
+    def get_limited(self, abytes, context):
+        return self.format_content(abytes, context)
+    
+    def escape(self, abytes):
+        return escape_bytes(abytes)
+    
+    def header(self, abytes, context):
+        if type(abytes) is bytes:
+            return ""
+        return type(abytes).__name__ + " "
+    
+    def __call__(self, abytes, context):
+        s = self.header(abytes, context) + "b'" + self.format_content(abytes, context) + "'"
         return context.text(s, "str")
 
 
-def format_str(obj, context):
-    return StrFormatter()(obj, context)
+def escape_bytes(abytes):
+    '''
+    Escape bytes as in a b'...' literal
+    '''
+    return codecs.escape_encode(bytes(abytes))[0].decode("ascii")
+
+format_bytes = BytesFormatter()
+format_bytearray = format_bytes
 
 
 class ListFormatter:
@@ -66,62 +391,60 @@ class ListFormatter:
         text += context.indent()
         if context.show_list_index():
             text += context.text("[")
-            text += context.format(index).rjust(index_width)
+            text += context.format_label(index).rjust(index_width)
             text += context.text("] ")
         return text
     
-    def format_abbr(self, alist, context, start, end):
+    def format_abbr(self, alist, context, start, end, is_last=False):
         text = context.text()
         with context.indented() as ctx:
             text += ctx.indent()
             if ctx.show_list_index():
                 text += ctx.text("[")
-                text += ctx.format(start)
+                text += ctx.format_label(start)
                 text += ctx.text("] ... [")
-                text += ctx.format(end - 1)
+                text += ctx.format_label(end - 1)
                 text += ctx.text("]")
             else:
                 text += ctx.text(" ... ", "list")
-            text += ctx.endl()
+            if not is_last:
+                text += ctx.endl()
         return text
         
     def abbr_range(self, length, context):
-        if context.limit() is None or length <= context.limit():
-            return None
-        else:
-            from math import (
-                ceil,
-                floor
-            )
-            abbr_start = int(ceil(context.limit() / 2))
-            abbr_end   = int(len(alist) - floor(context.limit() / 2))
-            return (abbr_start, abbr_end)
-    
-    def format_item(self, alist, context, index, is_last):
+        return abbr_range(length, context)
+    
+    def iter_item(self, alist, context, index, is_last):
         with context.indented() as ctx:
-            text = ctx.text()
-            text += self.format_index(alist, ctx, index)
-            text += ctx.format(alist[index])
+            text = self.format_index(alist, ctx, index)
+            yield text
+            yield from ctx.at_column(len(text)).iter_format(alist[index])
             if not is_last:
-                text += ctx.endl()
-            return text
+                yield ctx.endl()
     
-    def format_items(self, alist, context):
-        abbr = self.abbr_range(len(alist), context)
-        text = context.text()
+    def iter_range(self, alist, context, start, stop):
+        length = len(alist)
+        for index in range(start, stop):
+            if context.exhausted():
+                yield format_more_items(context, length - index, "list")
+                return True
+            is_last = (index == length - 1)
+            yield from self.iter_item(alist, context, index, is_last)
+        return False
+    
+    def iter_items(self, alist, context):
+        length = len(alist)
+        abbr = self.abbr_range(length, context)
         if abbr is None:
-            for index, item in enumerate(alist):
-                is_last = (index == len(alist) - 1)
-                text += self.format_item(alist, context, index, is_last)
+            yield from self.iter_range(alist, context, 0, length)
         else:
+            # Only the shown items are indexed
             abbr_start, abbr_end = abbr
-            for index, item in islice(enumerate(alist), abbr_start):
-                text += self.format_item(alist, context, index)
-            text += self.format_abbr(alist, context, abbr_start, abbr_end)
-            for index, item in islice(enumerate(alist), abbr_end, len(alist)):
-                is_last = (index == len(alist) - 1)
-                text += self.format_item(alist, context, index, is_last)
-        return text
+            if (yield from self.iter_range(alist, context, 0, abbr_start)):
+                return
+            yield self.format_abbr(alist, context, abbr_start, abbr_end,
+                is_last=(abbr_end == length))
+            yield from self.iter_range(alist, context, abbr_end, length)
     
     def format_empty(self, alist, context):
         return context.text("[]", "list")
@@ -132,19 +455,66 @@ class ListFormatter:
     def format_right_paren(self, alist, context):
         return context.text("]", "list")
     
-    def __call__(self, obj, context):
+    def format_elided(self, alist, context):
+        text = self.format_left_paren(alist, context)
+        text += context.text("... " + count_items(len(alist)))
+        text += self.format_right_paren(alist, context)
+        return text
+    
+    def iter_line_items(self, alist, context):
+        length = len(alist)
+        abbr = self.abbr_range(length, context)
+        if abbr is None:
+            head, tail = range(length), range(0)
+        else:
+            head, tail = range(abbr[0]), range(abbr[1], length)
+        return iter_line_items(context, head, tail, abbr, length,
+            lambda index: context.iter_format(alist[index]), "list")
+    
+    def json_fields(self, alist, context):
+        return {"len": len(alist)}
+    
+    def iter_json_items(self, alist, context):
+        length = len(alist)
+        abbr = self.abbr_range(length, context)
+        if abbr is None:
+            head, tail = range(length), range(0)
+        else:
+            head, tail = range(abbr[0]), range(abbr[1], length)
+        return iter_json_items(context, head, tail, abbr, length,
+            lambda index, ctx: ctx.iter_format(alist[index]))
+    
+    def iter_line(self, alist, context):
+        '''
+        Chunks of alist on one line, without indices
+        '''
+        yield self.format_left_paren(alist, context)
+        yield from self.iter_line_items(alist, context)
+        yield self.format_right_paren(alist, context)
+    
+    def iter_text(self, obj, context):
         alist = obj
         if not alist:
-            return self.format_empty(alist, context)
-        text = context.text()
+            yield self.format_empty(alist, context)
+            return
+        if not context.is_multiline():
+            yield from self.iter_line(alist, context)
+            return
+        if context.must_fit():
+            text = context.fit_on_line(self.iter_line(alist, context.singleline()))
+            if text is not None:
+                yield text
+                return
         
-        text += self.format_left_paren(alist, context)
-        text += context.endl()
-        text += self.format_items(alist, context)
-        text += context.endl()
-        text += context.outdent()
-        text += self.format_right_paren(alist, context)
-        return text
+        yield self.format_left_paren(alist, context)
+        yield context.endl()
+        yield from self.iter_items(alist, context)
+        yield context.endl()
+        yield context.outdent()
+        yield self.format_right_paren(alist, context)
+    
+    def __call__(self, obj, context):
+        return context.join(self.iter_text(obj, context))
 
 format_list = ListFormatter()
 
@@ -153,68 +523,162 @@ class DictFormatter:
     def format_empty(self, adict, context):
         return context.text("{}", "dict")
     
-    def format_item(self, adict, context, key, key_width, index):
+    def format_keys(self, adict, context, keys):
+        '''
+        Format keys as they are shown in items.
+        Each key is formatted once; the texts are used both for
+        the key width and for the output, so they are all kept
+        while the items are streamed.
+        '''
+        with context.indented() as ctx, ctx.key_context() as ctx_key:
+            return [ctx_key.format_label(key) for key in keys]
+    
+    def format_key(self, formated_key, key_width, context):
+        if len(formated_key) < context.limit_key_length():
+            return formated_key.rjust(key_width)
+        else:
+            return formated_key
+    
+    def iter_item(self, adict, context, key, formated_key, key_width, index):
         value = adict[key]
         with context.indented() as ctx:
             text = ctx.text()
             text += ctx.indent()
-            with ctx.key_context() as ctx_key:
-                formated_key = ctx_key.format(key)
-            
-            if len(formated_key) < ctx.limit_key_length():
-                text += formated_key.rjust(key_width)
-            else:
-                text += formated_key
-
+            text += self.format_key(formated_key, key_width, ctx)
             text += ": "
-            text += ctx.format(value)
-            text += ctx.endl()
-            return text
+            yield text
+            yield from ctx.at_column(len(text)).iter_format(value)
+            yield ctx.endl()
     
-    def key_width(self, adict, context):
-        key_strs = []
-        for key in adict:
-            with context.singleline() as ctx: 
-                key_strs.append(ctx.format(key))
-        return max(len(key_str) for key_str in key_strs if len(key_str) < context.limit_key_length())
+    def key_width(self, formated_keys, context):
+        '''
+        Width to align keys to.
+        Long keys and keys spanning several lines are not aligned.
+        '''
+        limit = context.limit_key_length()
+        return max((len(key) for key in formated_keys
+            if len(key) < limit and "\n" not in key.to_str()), default=0)
     
-    def format_items(self, adict, context):
-        keys = list(adict.keys())
-        try:
-            keys.sort()
-        except TypeError:
-            pass
-        
-        data = []
-        key_width = self.key_width(adict, context)
-        text = context.text()
-        for i, key in enumerate(keys):
-            text += self.format_item(adict, context, key, key_width, i)
-        return text
+    def format_abbr(self, adict, context):
+        with context.indented() as ctx:
+            return ctx.indent() + ctx.text("...", "dict") + ctx.endl()
+    
+    def select_keys(self, adict, context):
+        '''
+        Return (head, tail, abbr): the keys shown before and after
+        the "..." line, and the abbr_range of adict.
+        '''
+        return select_items(adict, context, context.sort_keys())
+    
+    def iter_items(self, adict, context, selection=None):
+        head, tail, abbr = selection or self.select_keys(adict, context)
+        formated_keys = self.format_keys(adict, context, head + tail)
+        key_width = self.key_width(formated_keys, context)
+        for i, key in enumerate(head):
+            if context.exhausted():
+                yield format_more_items(context, len(adict) - i, "dict") + context.endl()
+                return
+            yield from self.iter_item(adict, context, key, formated_keys[i], key_width, i)
+        if abbr is None:
+            if len(head) < len(adict):
+                # Trimmed to the budget (see budget_items)
+                yield format_more_items(context, len(adict) - len(head), "dict") + context.endl()
+            return
+        abbr_start, abbr_end = abbr
+        yield self.format_abbr(adict, context)
+        for i, key in enumerate(tail):
+            if context.exhausted():
+                yield format_more_items(context, len(tail) - i, "dict") + context.endl()
+                return
+            yield from self.iter_item(adict, context, key,
+                formated_keys[len(head) + i], key_width, abbr_end + i)
     
     def format_header(self, adict, context):
         if type(adict) == dict:
             return context.text()
         return context.text(type(adict).__name__, 'type')
     
-    def __call__(self, adict, context):
-        if not adict:
-            return self.format_empty(adict, context)
-        
+    def format_elided(self, adict, context):
         text = context.text()
         header = self.format_header(adict, context)
         if header:
             text += header
             text += context.space()
-
         text += context.text("{", "dict")
-        text += context.endl()
-        text += self.format_items(adict, context)
-        text += context.outdent() + context.text("}", "dict")
+        text += context.text("... " + count_items(len(adict)))
+        text += context.text("}", "dict")
         return text
+    
+    def json_fields(self, adict, context):
+        return {"len": len(adict)}
+    
+    def iter_json_item(self, adict, context, key):
+        '''
+        Chunks of the [key, value] pair of key.
+        The key is a label: it is not charged to max_nodes.
+        '''
+        yield "["
+        yield from context.iter_label(key)
+        yield ", "
+        yield from context.iter_format(adict[key])
+        yield "]"
+    
+    def iter_json_items(self, adict, context):
+        head, tail, abbr = self.select_keys(adict, context)
+        return iter_json_items(context, head, tail, abbr, len(adict),
+            lambda key, ctx: self.iter_json_item(adict, ctx, key))
+    
+    def iter_line_item(self, adict, context, key):
+        with context.key_context() as ctx_key:
+            yield ctx_key.format_label(key)
+        yield ": "
+        yield from context.iter_format(adict[key])
+    
+    def iter_line(self, adict, context, selection=None):
+        '''
+        Chunks of adict on one line
+        '''
+        header = self.format_header(adict, context)
+        if header:
+            yield header
+            yield context.space()
+        yield context.text("{", "dict")
+        head, tail, abbr = selection or self.select_keys(adict, context)
+        yield from iter_line_items(context, head, tail, abbr, len(adict),
+            lambda key: self.iter_line_item(adict, context, key), "dict")
+        yield context.text("}", "dict")
+    
+    def iter_text(self, adict, context):
+        if not adict:
+            yield self.format_empty(adict, context)
+            return
+        if not context.is_multiline():
+            yield from self.iter_line(adict, context)
+            return
+        selection = None
+        if context.must_fit():
+            # Keys are ordered once for both tries
+            selection = self.select_keys(adict, context)
+            text = context.fit_on_line(
+                self.iter_line(adict, context.singleline(), selection))
+            if text is not None:
+                yield text
+                return
+        
+        header = self.format_header(adict, context)
+        if header:
+            yield header
+            yield context.space()
+
+        yield context.text("{", "dict")
+        yield context.endl()
+        yield from self.iter_items(adict, context, selection)
+        yield context.outdent() + context.text("}", "dict")
+    
+    def __call__(self, adict, context):
+        return context.join(self.iter_text(adict, context))
 
-def format_dict(obj, context):
-    return DictFormatter()(obj, context)
+format_dict = DictFormatter()
 
 
 class DefaultdictFormatter(DictFormatter):
@@ -223,59 +687,205 @@ class DefaultdictFormatter(DictFormatter):
         text = context.text()
         text += context.text(type_name, 'type')
         text += context.space()
-        text += context.format(adict.default_factory)
+        text += context.format_label(adict.default_factory)
         return text
 
-
-def format_defaultdict(obj, context):
-    return DefaultdictFormatter()(obj, context)
+format_defaultdict = DefaultdictFormatter()
 
 
 class OrderedDictFormatter(DictFormatter):
-    def format_item(self, adict, context, key, key_width, index):
+    def iter_item(self, adict, context, key, formated_key, key_width, index):
         value = adict[key]
         with context.indented() as ctx:
             text = ctx.text()
             text += ctx.indent()
-            text += '[' + ctx.format(index) + ']'
+            text += '[' + ctx.format_label(index) + ']'
             text += ctx.space()
-            with ctx.key_context() as ctx_key:
-                formated_key = ctx_key.format(key)
-            
-            if len(formated_key) < ctx.limit_key_length():
-                text += formated_key.rjust(key_width)
-            else:
-                text += formated_key
-
+            text += self.format_key(formated_key, key_width, ctx)
             text += ": "
-            text += ctx.format(value)
-            text += ctx.endl()
-            return text
+            yield text
+            yield from ctx.at_column(len(text)).iter_format(value)
+            yield ctx.endl()
+
+format_OrderedDict = OrderedDictFormatter()
+
+
+# Per class, (names, checked, has_dict) of class_fields
+_class_fields = WeakKeyDictionary()
+
 
-def format_OrderedDict(obj, context):
-    return OrderedDictFormatter()(obj, context)
+def slot_names(cls):
+    '''
+    Names of the slots of cls and its bases, mangled as attributes
+    '''
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        for name in slots:
+            if name in ("__dict__", "__weakref__"):
+                continue
+            if name.startswith("__") and not name.endswith("__"):
+                name = "_" + klass.__name__.lstrip("_") + name
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def class_fields(cls):
+    '''
+    Return (names, checked, has_dict) for the instances of cls:
+    the names of their fields, whether the fields may be unset
+    (as slots may be), and whether the items of their __dict__ are
+    fields too.  Computed once per class.
+    '''
+    try:
+        return _class_fields[cls]
+    except KeyError:
+        pass
+    if issubclass(cls, tuple):
+        # namedtuple
+        fields = (list(cls._fields), False, False)
+    elif hasattr(cls, "__dataclass_fields__"):
+        # dataclasses is imported, as cls is a dataclass
+        import dataclasses
+        fields = ([f.name for f in dataclasses.fields(cls) if f.repr], True, False)
+    elif hasattr(cls, "__attrs_attrs__"):
+        # attrs classes, without importing attrs
+        fields = ([a.name for a in cls.__attrs_attrs__ if a.repr], True, False)
+    else:
+        fields = (slot_names(cls), True, True)
+    _class_fields[cls] = fields
+    return fields
+
+
+def has_instance_fields(cls):
+    '''
+    True if the instances of cls are formatted by their fields:
+    namedtuples, dataclasses, attrs classes and classes keeping the repr
+    and str of object
+    '''
+    if issubclass(cls, tuple):
+        return isinstance(getattr(cls, "_fields", None), tuple)
+    if hasattr(cls, "__dataclass_fields__") or hasattr(cls, "__attrs_attrs__"):
+        return True
+    if cls.__repr__ is not object.__repr__ or cls.__str__ is not object.__str__:
+        return False
+    # Builtin types like map keep the repr of object, but have no fields
+    return any("__dict__" in klass.__dict__ or "__slots__" in klass.__dict__
+        for klass in cls.__mro__)
+
+
+class InstanceFields:
+    '''
+    Read-only mapping of the field names of an instance to their values,
+    for DictFormatter
+    '''
+    __slots__ = ("obj", "names")
+    
+    def __init__(self, obj):
+        names, checked, has_dict = class_fields(type(obj))
+        if checked:
+            names = [name for name in names if hasattr(obj, name)]
+        if has_dict:
+            attrs = getattr(obj, "__dict__", None)
+            if attrs:
+                names = names + [name for name in attrs if name not in names]
+        self.obj = obj
+        self.names = names
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __iter__(self):
+        return iter(self.names)
+    
+    def __getitem__(self, name):
+        return getattr(self.obj, name)
+
+
+class InstanceFormatter(DictFormatter):
+    '''
+    Formats an instance like a dict of its fields, headed by its type:
+    namedtuple, dataclass and attrs fields, slots and __dict__ items.
+    The fields are shown in the order they are declared in.
+    '''
+    def format_empty(self, fields, context):
+        # Nothing to show but what str shows, like D() for a dataclass
+        return context.text(str(fields.obj))
+    
+    def format_header(self, fields, context):
+        return context.text(type(fields.obj).__name__, "type")
+    
+    def format_keys(self, fields, context, names):
+        with context.indented() as ctx:
+            return [ctx.text(name) for name in names]
+    
+    def iter_line_item(self, fields, context, name):
+        yield context.text(name)
+        yield ": "
+        yield from context.iter_format(fields[name])
+    
+    def select_keys(self, fields, context):
+        # In the order the fields are declared in
+        return select_items(fields.names, context, "insertion")
+    
+    def format_elided(self, obj, context):
+        return DictFormatter.format_elided(self, InstanceFields(obj), context)
+    
+    def json_fields(self, obj, context):
+        return {"len": len(InstanceFields(obj))}
+    
+    def iter_json_items(self, obj, context):
+        return DictFormatter.iter_json_items(self, InstanceFields(obj), context)
+    
+    def iter_text(self, obj, context):
+        if context.is_in_key_context():
+            # On one line, like K {a: 1, b: 2}, as keys are aligned
+            context = context.singleline()
+        return DictFormatter.iter_text(self, InstanceFields(obj), context)
+
+format_instance = InstanceFormatter()
 
 
 class SetFormatter:
-    def format_items(self, aset, context):
-        items = list(aset)
-        try:
-            items.sort()
-        except TypeError:
-            pass
-        
-        text = context.text()
-        for i, item in enumerate(items):
-            text += self.format_item(aset, context, item, i)
-        return text
+    def format_abbr(self, aset, context):
+        with context.indented() as ctx:
+            return ctx.indent() + ctx.text("...", "set") + ctx.endl()
+    
+    def select_items(self, aset, context):
+        '''
+        Return (head, tail, abbr): the items shown before and after
+        the "..." line, and the abbr_range of aset.
+        '''
+        return select_items(aset, context, context.sort_keys())
+    
+    def iter_items(self, aset, context, selection=None):
+        head, tail, abbr = selection or self.select_items(aset, context)
+        for i, item in enumerate(head):
+            if context.exhausted():
+                yield format_more_items(context, len(aset) - i, "set") + context.endl()
+                return
+            yield from self.iter_item(aset, context, item, i)
+        if abbr is None:
+            if len(head) < len(aset):
+                # Trimmed to the budget (see budget_items)
+                yield format_more_items(context, len(aset) - len(head), "set") + context.endl()
+            return
+        abbr_start, abbr_end = abbr
+        yield self.format_abbr(aset, context)
+        for i, item in enumerate(tail):
+            if context.exhausted():
+                yield format_more_items(context, len(tail) - i, "set") + context.endl()
+                return
+            yield from self.iter_item(aset, context, item, abbr_end + i)
         
-    def format_item(self, aset, context, item, index):
+    def iter_item(self, aset, context, item, index):
         with context.indented() as ctx:
-            text = ctx.text()
-            text += ctx.indent()
-            text += ctx.format(item)
-            text += ctx.endl()
-            return text
+            yield ctx.indent()
+            yield from ctx.iter_format(item)
+            yield ctx.endl()
     
     def format_header(self, aset, context):
         if type(aset) == set:
@@ -291,26 +901,81 @@ class SetFormatter:
         text += "{}"
         return text
     
-    def __call__(self, aset, context):
-        if not aset:
-            return self.format_empty(aset, context)
+    def format_elided(self, aset, context):
         text = context.text()
         header = self.format_header(aset, context)
         if header:
             text += header
             text += context.space()
         text += context.text("{", "set")
-        text += context.endl()
-        text += self.format_items(aset, context)
-        text += context.outdent() + context.text("}", "set")
+        text += context.text("... " + count_items(len(aset)))
+        text += context.text("}", "set")
         return text
+    
+    def json_fields(self, aset, context):
+        return {"len": len(aset)}
+    
+    def iter_json_items(self, aset, context):
+        head, tail, abbr = self.select_items(aset, context)
+        return iter_json_items(context, head, tail, abbr, len(aset),
+            lambda item, ctx: ctx.iter_format(item))
+    
+    def iter_line(self, aset, context, selection=None):
+        '''
+        Chunks of aset on one line
+        '''
+        header = self.format_header(aset, context)
+        if header:
+            yield header
+            yield context.space()
+        yield context.text("{", "set")
+        head, tail, abbr = selection or self.select_items(aset, context)
+        yield from iter_line_items(context, head, tail, abbr, len(aset),
+            context.iter_format, "set")
+        yield context.text("}", "set")
+    
+    def iter_text(self, aset, context):
+        if not aset:
+            yield self.format_empty(aset, context)
+            return
+        if not context.is_multiline():
+            yield from self.iter_line(aset, context)
+            return
+        selection = None
+        if context.must_fit():
+            # Items are ordered once for both tries
+            selection = self.select_items(aset, context)
+            text = context.fit_on_line(
+                self.iter_line(aset, context.singleline(), selection))
+            if text is not None:
+                yield text
+                return
+        header = self.format_header(aset, context)
+        if header:
+            yield header
+            yield context.space()
+        yield context.text("{", "set")
+        yield context.endl()
+        yield from self.iter_items(aset, context, selection)
+        yield context.outdent() + context.text("}", "set")
+    
+    def __call__(self, aset, context):
+        return context.join(self.iter_text(aset, context))
+
+format_set = SetFormatter()
 
 
-def format_set(obj, context):
-    return SetFormatter()(obj, context)
+def is_namedtuple(obj):
+    atype = type(obj)
+    return (atype is not tuple
+        and isinstance(getattr(atype, "_fields", None), tuple))
 
 
 class TupleFormatter(ListFormatter):
+    '''
+    Formats tuples.  Namedtuples are formatted by their fields, like
+    instances, except as dict keys, where they are formatted as tuples.
+    '''
     def format_left_paren(self, atuple, context):
         return context.text("(", "tuple")
     
@@ -319,11 +984,37 @@ class TupleFormatter(ListFormatter):
     
     def format_as_key(self, atuple, context):
         return format_tuple_as_key(atuple, context)
-        
-    def __call__(self, atuple, context):
+    
+    def iter_line_items(self, atuple, context):
+        yield from ListFormatter.iter_line_items(self, atuple, context)
+        if len(atuple) == 1:
+            yield context.text(",")
+    
+    def format_elided(self, atuple, context):
+        if is_namedtuple(atuple) and not context.is_in_key_context():
+            return format_instance.format_elided(atuple, context)
+        return ListFormatter.format_elided(self, atuple, context)
+    
+    def json_fields(self, atuple, context):
+        if is_namedtuple(atuple):
+            return format_instance.json_fields(atuple, context)
+        return ListFormatter.json_fields(self, atuple, context)
+    
+    def iter_json_items(self, atuple, context):
+        if is_namedtuple(atuple):
+            return format_instance.iter_json_items(atuple, context)
+        return ListFormatter.iter_json_items(self, atuple, context)
+    
+    def iter_text(self, atuple, context):
         if not context.is_in_key_context():
-            return ListFormatter.__call__(self, atuple, context)
-        return self.format_as_key(atuple, context)
+            if is_namedtuple(atuple):
+                yield from format_instance.iter_text(atuple, context)
+            else:
+                yield from ListFormatter.iter_text(self, atuple, context)
+        elif not context.is_multiline():
+            yield from ListFormatter.iter_text(self, atuple, context)
+        else:
+            yield self.format_as_key(atuple, context)
 
 
 def format_tuple_as_key(atuple, context):
@@ -348,8 +1039,337 @@ def format_tuple_as_key(atuple, context):
     text += context.text(")", "tuple")
     return text
 
-def format_tuple(obj, context):
-    return TupleFormatter()(obj, context)
+format_tuple = TupleFormatter()
+
+
+class ArrayFormatter(ListFormatter):
+    '''
+    Formats array.array like a list, headed by its typecode.
+    Only the shown items are indexed.
+    '''
+    def format_header(self, anarray, context):
+        text = context.text(type(anarray).__name__, "type")
+        text += context.text("('{}') ".format(anarray.typecode))
+        return text
+    
+    def format_empty(self, anarray, context):
+        return self.format_header(anarray, context) + context.text("[]", "list")
+    
+    def format_left_paren(self, anarray, context):
+        return self.format_header(anarray, context) + context.text("[", "list")
+
+format_array = ArrayFormatter()
+
+
+class MemoryviewFormatter(ListFormatter):
+    '''
+    Formats a memoryview with its format, shape and strides.
+    One-dimensional views show their items like a list, indexing only
+    the shown items; the underlying buffer is never copied.  Views
+    memoryview cannot index (ctypes arrays, array('u')) show their
+    size like multi-dimensional views.
+    '''
+    def format_header(self, view, context):
+        text = context.text(type(view).__name__, "type")
+        text += context.text(
+            "(format={!r}, itemsize={}, shape={}, strides={}{}) ".format(
+                view.format, view.itemsize, view.shape, view.strides,
+                ", readonly" if view.readonly else ""))
+        return text
+    
+    def format_empty(self, view, context):
+        return self.format_header(view, context) + context.text("[]", "list")
+    
+    def format_left_paren(self, view, context):
+        return self.format_header(view, context) + context.text("[", "list")
+    
+    def is_listed(self, view):
+        '''
+        True if the items of view are shown, that is if it is
+        one-dimensional and memoryview supports its format
+        '''
+        try:
+            if view.ndim != 1:
+                return False
+        except ValueError:
+            # Released
+            return False
+        if len(view) == 0:
+            return True
+        try:
+            view[0]
+        except NotImplementedError:
+            return False
+        return True
+    
+    def json_fields(self, view, context):
+        if self.is_listed(view):
+            return {"len": len(view), "format": view.format}
+        context = context.text_context()
+        return {"repr": context.join(self.iter_text(view, context)).to_str()}
+    
+    def iter_json_items(self, view, context):
+        if not self.is_listed(view):
+            return None
+        return ListFormatter.iter_json_items(self, view, context)
+    
+    def iter_text(self, view, context):
+        try:
+            view.ndim
+        except ValueError:
+            yield context.text("<released memoryview>")
+            return
+        if self.is_listed(view):
+            yield from ListFormatter.iter_text(self, view, context)
+        else:
+            yield self.format_header(view, context)
+            yield context.text("[... {} bytes]".format(view.nbytes), "list")
+
+format_memoryview = MemoryviewFormatter()
+
+
+class NdarrayFormatter:
+    '''
+    Formats numpy.ndarray with its dtype, shape and strides.
+    The items are converted by numpy.array2string, which only looks at
+    the edge items of arrays larger than the limit.
+    '''
+    def format_header(self, array, context):
+        text = context.text(type(array).__name__, "type")
+        text += context.text("(dtype={}, shape={}, strides={})".format(
+            array.dtype, array.shape, array.strides))
+        return text
+    
+    def format_items(self, array, context):
+        import numpy
+        limit = context.limit()
+        if limit is None:
+            threshold, edgeitems = sys.maxsize, 3
+        else:
+            threshold, edgeitems = limit, max(int(ceil(limit / 2)), 1)
+        return numpy.array2string(array, threshold=threshold, edgeitems=edgeitems)
+    
+    def __call__(self, array, context):
+        text = self.format_header(array, context)
+        lines = self.format_items(array, context).split("\n")
+        if len(lines) == 1 or not context.is_multiline():
+            text += context.space()
+            text += context.text(" ".join(line.strip() for line in lines), "list")
+            return text
+        with context.indented() as ctx:
+            for line in lines:
+                text += ctx.endl()
+                text += ctx.indent()
+                text += ctx.text(line, "list")
+        return text
+
+format_ndarray = NdarrayFormatter()
+
+
+class DictItemsFormatter(DictFormatter):
+    '''
+    Formats dict_items like the dict it is a view of, headed by its type.
+    The dict is read through view.mapping, without copying it.
+    '''
+    def format_header(self, mapping, context):
+        return context.text("dict_items", "type")
+    
+    def format_empty(self, mapping, context):
+        return self.format_header(mapping, context) + context.text(" {}", "dict")
+    
+    def format_elided(self, view, context):
+        return DictFormatter.format_elided(self, view.mapping, context)
+    
+    def json_fields(self, view, context):
+        return {"len": len(view)}
+    
+    def iter_json_items(self, view, context):
+        return DictFormatter.iter_json_items(self, view.mapping, context)
+    
+    def iter_text(self, view, context):
+        return DictFormatter.iter_text(self, view.mapping, context)
+
+# dict views have a mapping attribute since Python 3.10;
+# before, dict_items is formatted as a set of (key, value) tuples
+if hasattr({}.items(), "mapping"):
+    format_dict_items = DictItemsFormatter()
+else:
+    format_dict_items = format_set
+
+# dict_keys is a set-like view: SetFormatter takes it as it is
+format_dict_keys = format_set
+
+
+class ShownItems:
+    '''
+    The items of a sized iterable, like dict_values, which are shown
+    with the limit option, indexed as in a list.
+    Only those items are taken from the iterable: the head by iterating
+    it, the tail by iterating it in reverse.
+    '''
+    __slots__ = ("length", "head", "tail", "tail_start")
+    
+    def __init__(self, iterable, context):
+        self.length = len(iterable)
+        abbr = abbr_range(self.length, context)
+        if abbr is None:
+            self.head, self.tail, self.tail_start = list(iterable), [], self.length
+        else:
+            self.head = list(islice(iterable, abbr[0]))
+            self.tail = list(islice(reversed(iterable), self.length - abbr[1]))
+            self.tail.reverse()
+            self.tail_start = abbr[1]
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, index):
+        if index < len(self.head):
+            return self.head[index]
+        return self.tail[index - self.tail_start]
+
+
+class DictValuesFormatter(ListFormatter):
+    '''
+    Formats dict_values like a list, headed by its type.
+    Only the shown values are taken from the view (see ShownItems).
+    '''
+    def format_header(self, view, context):
+        return context.text("dict_values", "type") + context.space()
+    
+    def format_empty(self, view, context):
+        return self.format_header(view, context) + context.text("[]", "list")
+    
+    def format_left_paren(self, view, context):
+        return self.format_header(view, context) + context.text("[", "list")
+    
+    def iter_json_items(self, view, context):
+        return ListFormatter.iter_json_items(self, ShownItems(view, context), context)
+    
+    def iter_text(self, view, context):
+        return ListFormatter.iter_text(self, ShownItems(view, context), context)
+
+format_dict_values = DictValuesFormatter()
+
+
+class RangeFormatter:
+    '''
+    Formats range by its bounds, as range(start, stop[, step])
+    '''
+    def __call__(self, arange, context):
+        text = context.text("range", "type")
+        text += context.text("(")
+        text += context.format_label(arange.start)
+        text += context.text(", ")
+        text += context.format_label(arange.stop)
+        if arange.step != 1:
+            text += context.text(", ")
+            text += context.format_label(arange.step)
+        text += context.text(")")
+        return text
+    
+    def json_fields(self, arange, context):
+        return {
+            "start": arange.start,
+            "stop": arange.stop,
+            "step": arange.step,
+            "len": len(arange),
+        }
+
+format_range = RangeFormatter()
+
+
+def is_iterator(cls):
+    '''
+    True for iterators and generators, except files and the objects
+    formatted by their fields
+    '''
+    return (hasattr(cls, "__next__") and hasattr(cls, "__iter__")
+        and not hasattr(cls, "read") and not has_instance_fields(cls))
+
+
+class PeekedItems(list):
+    '''
+    The items taken from an iterator for the peek option.
+    repr is the str of the iterator before they were taken, and
+    more is true if the iterator may have more items.
+    '''
+    __slots__ = ("iterator", "repr", "more")
+    
+    def __init__(self, iterator, count):
+        self.repr = str(iterator)
+        list.__init__(self, islice(iterator, count))
+        self.iterator = iterator
+        self.more = (len(self) == count)
+
+
+class IteratorFormatter(ListFormatter):
+    '''
+    Formats iterators and generators by their str, followed by their
+    first items if the peek option is set.
+    Peeking takes the items from the iterator: they are consumed, and
+    the iterator goes on after them.  The other items are not touched.
+    '''
+    def format_header(self, items, context):
+        return context.text(items.repr, "type") + context.space()
+    
+    def format_empty(self, items, context):
+        return self.format_header(items, context) + context.text("[]", "list")
+    
+    def format_left_paren(self, items, context):
+        return self.format_header(items, context) + context.text("[", "list")
+    
+    def format_elided(self, iterator, context):
+        return context.text(str(iterator), "type")
+    
+    def format_more(self, items, context):
+        with context.indented() as ctx:
+            return ctx.endl() + ctx.indent() + ctx.text("...", "list")
+    
+    def iter_items(self, items, context):
+        yield from ListFormatter.iter_items(self, items, context)
+        if items.more:
+            yield self.format_more(items, context)
+    
+    def iter_line_items(self, items, context):
+        yield from ListFormatter.iter_line_items(self, items, context)
+        if items.more:
+            yield context.text(", ...", "list")
+    
+    def peek(self, iterator, context):
+        count = context.peek()
+        return context.peeked(iterator, lambda it: PeekedItems(it, count))
+    
+    def json_fields(self, iterator, context):
+        if not context.peek():
+            return {"repr": str(iterator)}
+        return {"repr": self.peek(iterator, context).repr}
+    
+    def iter_json_items(self, iterator, context):
+        count = context.peek()
+        if not count:
+            return None
+        return self.iter_json_peeked(self.peek(iterator, context), context)
+    
+    def iter_json_peeked(self, items, context):
+        '''
+        Chunks of the peeked items in a JSON array, followed by
+        {"omitted": null} if the iterator may have more
+        '''
+        yield from ListFormatter.iter_json_items(self, items, context)
+        if items.more:
+            with context.indented() as ctx:
+                yield ctx.json_separator(False)
+                yield '{"omitted": null}'
+    
+    def iter_text(self, iterator, context):
+        count = context.peek()
+        if not count:
+            yield context.text(str(iterator))
+            return
+        yield from ListFormatter.iter_text(self, self.peek(iterator, context), context)
+
+format_iterator = IteratorFormatter()
 
 
 class TypeFormatter:
@@ -377,7 +1397,11 @@ def format_function(obj, context):
 
 class MethodFormatter(FunctionFormatter):
     def __call__(self, amethod, context):
-        text = context.format(amethod.__self__)
+        if has_instance_fields(type(amethod.__self__)):
+            # By its str: its fields would bury the method
+            text = format_object(amethod.__self__, context)
+        else:
+            text = context.format_label(amethod.__self__)
         text += '.'
         text += super().__call__(amethod, context)
         return text
@@ -0,0 +1,130 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Formatting of large containers in a pool of processes.
+
+The top-level object is formatted in the calling process, except for its
+items, which are recorded (see FormatContext.defer) and formatted by
+forked workers.  Forked workers inherit the objects, so nothing but the
+output is pickled, and ids shown in the output are the same as in the
+calling process: the result is identical to formatting serially.
+
+Forking a process running several threads is unsafe (a lock held by
+another thread stays locked in the child), so objects are formatted
+serially while other threads are running.
+'''
+import threading
+from .formatcontext import Deferred
+
+# Items per worker task are about len(jobs) / (workers * TASKS_PER_WORKER)
+TASKS_PER_WORKER = 4
+
+# Fewer items are formatted serially: starting a pool takes tens of
+# milliseconds, about as long as formatting a few hundred small items
+MIN_JOBS = 1000
+
+# (builder, options, jobs) of the formatting, in worker processes only
+_worker_state = None
+
+
+def init_worker(state):
+    '''
+    Pool initializer: state is inherited by the forked worker, not pickled
+    '''
+    global _worker_state
+    _worker_state = state
+
+
+def can_format_in_parallel(options):
+    '''
+    True if the output of each item does not depend on the others:
+    budgets and shared references are counted across the whole call.
+    Profiles are not collected from the workers either, and iterators
+    must not be peeked once for planning and again for formatting.
+    With width, containers are joined to try fitting them on a line,
+    which can't be done with the Deferred chunks of their items.
+    '''
+    return (options.get("max_nodes") is None
+        and options.get("max_output_chars") is None
+        and not options.get("shared_refs")
+        and not options.get("profile")
+        and not options.get("peek")
+        and options.get("width") is None)
+
+
+def plan(obj, builder, options, depth):
+    '''
+    Format obj deferring the objects at depth.
+    Return (chunks, jobs), or None if obj can't be formatted this way.
+    '''
+    context = builder.build(options)
+    deferred = context.defer(depth)
+    try:
+        chunks = list(context.iter_format(obj))
+    except Exception:
+        # A formatter which joins the chunks of its items can't take
+        # Deferred chunks; the serial formatting raises genuine errors.
+        return None
+    return chunks, deferred.jobs
+
+
+def format_jobs(bounds):
+    '''
+    Format jobs[start:stop] in a worker; return the output of each job
+    '''
+    start, stop = bounds
+    builder, options, jobs = _worker_state
+    context = builder.build(options)
+    outputs = []
+    for obj, state, snapshot in jobs[start:stop]:
+        context.resume(snapshot)
+        ctx = context.derived(state)
+        renderer = options.renderer()
+        outputs.append(renderer(ctx.join(ctx.iter_format(obj))) + renderer.close())
+    return outputs
+
+
+def pformat(obj, builder, options, workers):
+    '''
+    Format obj with options like AwesomePrinter, in workers processes.
+    Return None if obj must be formatted serially: the platform can't
+    fork, other threads are running, obj has fewer than MIN_JOBS items
+    (or than workers), or the formatting failed.
+    '''
+    if not can_format_in_parallel(options):
+        return None
+    if threading.active_count() > 1:
+        return None
+    try:
+        import multiprocessing
+        mp_context = multiprocessing.get_context("fork")
+    except ValueError:
+        return None
+
+    # Top-level items, or the second level if there are few
+    min_jobs = max(workers, MIN_JOBS)
+    planned = None
+    for depth in (1, 2):
+        planned = plan(obj, builder, options, depth)
+        if planned is None or len(planned[1]) >= min_jobs:
+            break
+    if planned is None or len(planned[1]) < min_jobs:
+        return None
+    chunks, jobs = planned
+
+    tasks = min(workers * TASKS_PER_WORKER, len(jobs))
+    bounds = [(len(jobs) * i // tasks, len(jobs) * (i + 1) // tasks)
+        for i in range(tasks)]
+    try:
+        with mp_context.Pool(min(workers, tasks), init_worker,
+                ((builder, options, jobs),)) as pool:
+            results = pool.map(format_jobs, bounds)
+    except Exception:
+        return None
+
+    outputs = [s for result in results for s in result]
+    renderer = options.renderer()
+    buf = [outputs[chunk.index] if type(chunk) is Deferred else renderer(chunk)
+        for chunk in chunks]
+    buf.append(renderer.close())
+    return "".join(buf)
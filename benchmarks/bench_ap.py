@@ -0,0 +1,50 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Latency of ap() at several stack depths.
+
+    $ python benchmarks/bench_ap.py
+'''
+import contextlib
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from aprint import ap
+
+
+def call_at_depth(depth, func):
+    if depth <= 0:
+        _ = 42
+        return func()
+    return call_at_depth(depth - 1, func)
+
+
+def noop():
+    pass
+
+
+def measure(func):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(5, number)) / number
+
+
+def main():
+    sys.setrecursionlimit(10000)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for depth in (10, 100, 500):
+            # Subtract the cost of reaching the depth
+            best = measure(lambda: call_at_depth(depth, ap))
+            best -= measure(lambda: call_at_depth(depth, noop))
+            sys.__stdout__.write("depth {:>3}: {:8.2f} us/call\n".format(depth, best * 1e6))
+            out.seek(0)
+            out.truncate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+pformat on a dict with many tuple keys.
+
+    $ python benchmarks/bench_dict_keys.py [number_of_keys]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    adict = {(i, str(i), (i, i + 1)): i for i in range(n)}
+    start = time.perf_counter()
+    s = aprint.pformat(adict, limit=None)
+    elapsed = time.perf_counter() - start
+    print("{} tuple keys: {:.3f} s, {} chars".format(n, elapsed, len(s)))
+
+
+if __name__ == "__main__":
+    main()
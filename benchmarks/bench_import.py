@@ -0,0 +1,71 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Startup cost of "import aprint", measured with python -X importtime.
+
+Exits with status 1 if the import takes longer than the budget, or if
+colorama is imported by "import aprint" or by pformat.
+
+    $ python benchmarks/bench_import.py [--budget-ms 20] [--runs 7]
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def run_python(code, env, *options):
+    return subprocess.run(
+        [sys.executable] + list(options) + ["-c", code],
+        env=env, cwd=ROOT, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+
+
+def import_time_us(env):
+    result = run_python("import aprint", env, "-X", "importtime")
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "aprint":
+            return int(fields[1])
+    raise RuntimeError("aprint not found in -X importtime output")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=20.0)
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+    
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    # Measure with bytecode cached, as in an installed package
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPYCACHEPREFIX"] = tempfile.mkdtemp(prefix="aprint-bench-")
+    import_time_us(env)
+    
+    best_ms = min(import_time_us(env) for _ in range(args.runs)) / 1000
+    print("import aprint: {:.2f} ms (budget {:.2f} ms)".format(best_ms, args.budget_ms))
+    
+    failed = best_ms > args.budget_ms
+    checks = [
+        ("import aprint", "import aprint, sys; print('colorama' in sys.modules)"),
+        ("pformat", "import aprint, sys; aprint.pformat({1: [2]}); print('colorama' in sys.modules)"),
+    ]
+    for name, code in checks:
+        if run_python(code, env).stdout.strip() != "False":
+            print("{} imports colorama".format(name))
+            failed = True
+    
+    if failed:
+        print("FAILED")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+pformat on deep and on wide structures, and the cost per nesting level
+of each engine on nested lists of moderate depth.
+
+    $ python benchmarks/bench_nesting.py
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+def deep(depth):
+    root = []
+    current = root
+    for i in range(depth):
+        child = [i, {"next": []}]
+        current.append(child)
+        current = child[1]["next"]
+    return root
+
+
+def nested(depth):
+    root = []
+    for i in range(depth):
+        root = [root]
+    return root
+
+
+def per_level(obj, depth, repeat=50, **kw):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        aprint.pformat(obj, limit=None, indent=1, **kw)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / depth * 1e6
+
+
+def wide(width):
+    return {i: [i, str(i), {"k": i}] for i in range(width)}
+
+
+def main():
+    cases = [
+        ("deep 2000", deep(2000), dict(indent=1)),
+        ("wide 20000", wide(20000), dict()),
+    ]
+    for name, obj, kw in cases:
+        start = time.perf_counter()
+        s = aprint.pformat(obj, limit=None, **kw)
+        elapsed = time.perf_counter() - start
+        print("{:<12} {:8.3f} s {:>12} chars".format(name, elapsed, len(s)))
+    print()
+    print("us/level     recursive     auto  iterative")
+    for depth in (20, 100, 400):
+        obj = nested(depth)
+        row = []
+        for engine in ("recursive", "auto", "iterative"):
+            # The recursive engine cannot reach the deepest case.
+            if engine == "recursive" and depth > 100:
+                row.append("-")
+                continue
+            row.append("{:.1f}".format(
+                per_level(obj, depth, engine=engine)))
+        print("{:<12} {:>9} {:>8} {:>10}".format(
+            "depth {}".format(depth), *row))
+
+
+if __name__ == "__main__":
+    main()
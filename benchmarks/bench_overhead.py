@@ -0,0 +1,55 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Per-call overhead of pformat for tiny objects.
+
+    $ python benchmarks/bench_overhead.py
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+from aprint import (
+    AwesomePrinter,
+    Options,
+    NullColorScheme,
+    Printer,
+    default_builder,
+)
+from io import StringIO
+
+
+def pformat_rebuilding(obj):
+    # What every call used to do: fresh options, scheme and registry
+    stream = StringIO()
+    options = Options(color_scheme=NullColorScheme())
+    AwesomePrinter(stream, options, default_builder()).pprint(obj)
+    return stream.getvalue()
+
+
+def main():
+    printer = Printer()
+    cases = [
+        ("int", 42),
+        ("str", "spam"),
+        ("small dict", {"status": "ok", "code": 200}),
+    ]
+    funcs = [
+        ("rebuild per call", pformat_rebuilding),
+        ("aprint.pformat", aprint.pformat),
+        ("Printer.pformat", printer.pformat),
+    ]
+    for case_name, obj in cases:
+        for func_name, func in funcs:
+            timer = timeit.Timer(lambda: func(obj))
+            number, _ = timer.autorange()
+            best = min(timer.repeat(5, number)) / number
+            print("{:<12} {:<18} {:8.2f} us/call".format(
+                case_name, func_name, best * 1e6))
+
+
+if __name__ == "__main__":
+    main()
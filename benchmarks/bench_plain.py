@@ -0,0 +1,54 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+pformat with PlainText, as for uncolored output, against ComplexText.
+
+    $ python benchmarks/bench_plain.py
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from aprint import (
+    AwesomePrinter,
+    NullColorScheme,
+    Options,
+)
+from aprint.formatcontext import ComplexText
+from io import StringIO
+from bench_nesting import deep, wide
+
+
+class ComplexTextScheme(NullColorScheme):
+    # Uncolored, but built with ComplexText as before PlainText
+    def text_type(self):
+        return ComplexText
+
+
+def pformat(obj, options):
+    stream = StringIO()
+    AwesomePrinter(stream, options).pprint(obj)
+    return stream.getvalue()
+
+
+def main():
+    cases = [
+        ("wide 2000", wide(2000), dict(limit=None)),
+        ("deep 300", deep(300), dict(limit=None, indent=1)),
+        ("strings 10000", [str(i) for i in range(10000)], dict(limit=None)),
+    ]
+    for name, obj, kw in cases:
+        options = [
+            ("ComplexText", Options(color_scheme=ComplexTextScheme(), **kw)),
+            ("PlainText", Options(color_scheme=NullColorScheme(), **kw)),
+        ]
+        assert pformat(obj, options[0][1]) == pformat(obj, options[1][1])
+        for text_name, opts in options:
+            best = min(timeit.repeat(lambda: pformat(obj, opts), number=1, repeat=5))
+            print("{:<14} {:<12} {:8.3f} s".format(name, text_name, best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+pformat of a huge str and bytes, and of many short strings.
+The time for a huge string should not depend on its length.
+
+    $ python benchmarks/bench_strings.py
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+def main():
+    size = 100 * 1024 * 1024
+    cases = [
+        ("str 100MB", "spam\n" * (size // 5), {}),
+        ("bytes 100MB", b"spam\n" * (size // 5), {}),
+        ("1M short str", ["s{}\t".format(i) for i in range(1000000)], dict(limit=None)),
+    ]
+    for name, obj, kw in cases:
+        best = min(timeit.repeat(lambda: aprint.pformat(obj, **kw), number=1, repeat=3))
+        print("{:<14} {:10.6f} s".format(name, best))
+
+
+if __name__ == "__main__":
+    main()
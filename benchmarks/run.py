@@ -0,0 +1,252 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Benchmark suite for the hot paths of aprint.
+
+For each case, prints the median operations per second over the
+repeats, the peak memory of one operation (tracemalloc) and the number
+of garbage collections one operation triggers.
+
+    $ python benchmarks/run.py [-k NAME] [--quick]
+    $ python benchmarks/run.py --save baseline.json
+    $ python benchmarks/run.py --compare baseline.json [--tolerance 50]
+
+With --compare, exits with status 1 if a case is slower than the
+baseline by more than the tolerance, or peaks higher by more than the
+memory tolerance (both in percent).  Timings on a shared machine vary by
+30% or more between runs, so the default tolerance is a wide 50%: it
+catches a case becoming twice as slow, not small changes.  Garbage
+collections are only reported.
+The other bench_*.py scripts measure single topics in more detail.
+'''
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+from aprint import Printer
+from bench_nesting import deep, wide
+
+
+def wide_list():
+    obj = [[i, str(i), i / 7, None, {"k": i}] for i in range(2000)]
+    return lambda: aprint.pformat(obj, limit=None)
+
+
+def deep_nesting():
+    obj = deep(300)
+    return lambda: aprint.pformat(obj, limit=None, indent=1)
+
+
+def big_dict_mixed_keys():
+    obj = {}
+    for i in range(1000):
+        obj[i] = i
+        obj[str(i)] = [i]
+        obj[(i, str(i))] = None
+    return lambda: aprint.pformat(obj, limit=None)
+
+
+def big_dict_abbreviated():
+    obj = {i: str(i) for i in range(100000)}
+    return lambda: aprint.pformat(obj)
+
+
+def large_set():
+    obj = set(range(5000)) | set(map(str, range(5000)))
+    return lambda: aprint.pformat(obj, limit=None)
+
+
+def large_set_abbreviated():
+    obj = set(range(100000))
+    return lambda: aprint.pformat(obj)
+
+
+def long_string():
+    obj = "spam " * 2000000
+    return lambda: aprint.pformat(obj)
+
+
+def many_short_strings():
+    obj = ["s{}\n".format(i) for i in range(10000)]
+    return lambda: aprint.pformat(obj, limit=None)
+
+
+def plain_rendering():
+    obj = wide(1000)
+    printer = Printer(colored=False, limit=None)
+    return lambda: printer.pprint(obj, io.StringIO())
+
+
+def colored_rendering():
+    obj = wide(1000)
+    printer = Printer(colored=True, limit=None)
+    return lambda: printer.pprint(obj, io.StringIO())
+
+
+def ap_small():
+    out = io.StringIO()
+    obj = {"status": "ok", "code": 200}
+    def run():
+        with contextlib.redirect_stdout(out):
+            aprint.ap(obj)
+        out.seek(0)
+        out.truncate()
+    return run
+
+
+CASES = [
+    ("wide list", wide_list),
+    ("deep nesting", deep_nesting),
+    ("big dict, mixed keys", big_dict_mixed_keys),
+    ("big dict, abbreviated", big_dict_abbreviated),
+    ("large set", large_set),
+    ("large set, abbreviated", large_set_abbreviated),
+    ("long string", long_string),
+    ("many short strings", many_short_strings),
+    ("pprint plain", plain_rendering),
+    ("pprint colored", colored_rendering),
+    ("ap", ap_small),
+]
+
+
+def ops_per_sec(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return number / statistics.median(timer.repeat(repeat, number))
+
+
+def peak_kib(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def gc_collections(func):
+    '''
+    Number of garbage collections, of any generation, triggered by func.
+    A collection starts when the gc tracked objects allocated minus those
+    freed since the last one exceed threshold0, so this counts the
+    objects func keeps alive at once rather than all it allocates.
+    '''
+    collections = [0]
+    def callback(phase, info):
+        if phase == "start":
+            collections[0] += 1
+    gc.collect()
+    gc.callbacks.append(callback)
+    try:
+        func()
+    finally:
+        gc.callbacks.remove(callback)
+    return collections[0]
+
+
+def run(cases, repeat):
+    results = {}
+    for name, setup in cases:
+        func = setup()
+        results[name] = {
+            "ops_per_sec": ops_per_sec(func, repeat),
+            "peak_kib": peak_kib(func),
+            "gc_collections": gc_collections(func),
+        }
+        print_result(name, results[name])
+    return results
+
+
+def print_result(name, result):
+    line = "{:<24} {:>12.1f} ops/s {:>12.1f} KiB {:>6} gc".format(
+        name, result["ops_per_sec"], result["peak_kib"], result["gc_collections"])
+    print(line)
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    '''
+    Print the changes from baseline; return the names of regressed cases
+    '''
+    regressed = []
+    print()
+    print("{:<24} {:>10} {:>10} {:>10}".format("vs baseline", "ops/s", "peak", "gc"))
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        changes = []
+        worse = False
+        # ops/s higher is better, peak memory lower is better
+        for key, sign, limit in (("ops_per_sec", 1, tolerance),
+                                 ("peak_kib", -1, memory_tolerance)):
+            if not base.get(key):
+                changes.append("")
+                continue
+            change = (result[key] - base[key]) / base[key] * 100
+            changes.append("{:+.1f}%".format(change))
+            if limit is not None and sign * change < -limit:
+                worse = True
+        if "gc_collections" in base:
+            changes.append("{:+d}".format(
+                result["gc_collections"] - base["gc_collections"]))
+        else:
+            changes.append("")
+        if worse:
+            regressed.append(name)
+        print("{:<24} {:>10} {:>10} {:>10}{}".format(
+            name, *changes, "  REGRESSED" if worse else ""))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-k", dest="keyword", default="",
+        help="only run the cases whose name contains KEYWORD")
+    parser.add_argument("--quick", action="store_true",
+        help="time each case 3 times instead of 15")
+    parser.add_argument("--save", metavar="FILE",
+        help="write the results to FILE as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE",
+        help="compare the results to the JSON baseline FILE")
+    parser.add_argument("--tolerance", type=float, default=50.0,
+        help="percentage of ops/s lost reported as a regression [default 50]")
+    parser.add_argument("--memory-tolerance", type=float, default=10.0,
+        help="percentage of peak memory gained reported as a regression [default 10]")
+    args = parser.parse_args()
+
+    cases = [(name, setup) for name, setup in CASES if args.keyword in name]
+    results = run(cases, 3 if args.quick else 15)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("python") != platform.python_version():
+            print("baseline was measured with Python {}".format(baseline.get("python")))
+        if compare(results, baseline["results"], args.tolerance,
+                   args.memory_tolerance):
+            print("FAILED")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
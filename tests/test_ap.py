@@ -0,0 +1,76 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+The ap() short-cut
+
+    $ python -m unittest discover tests
+'''
+import builtins
+import contextlib
+import io
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+from aprint import ap
+
+MISSING = object()
+
+
+def printed(function, *a):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        function(*a)
+    return re.sub("\x1b\\[[0-9;]*m", "", out.getvalue())
+
+
+class ApTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = getattr(builtins, "_", MISSING)
+    
+    def tearDown(self):
+        if self.saved is MISSING:
+            if hasattr(builtins, "_"):
+                del builtins._
+        else:
+            builtins._ = self.saved
+    
+    def test_objects(self):
+        self.assertEqual(printed(ap, 42, "spam"), "42\n'spam'\n")
+    
+    def test_caller_local(self):
+        def caller():
+            _ = [1]
+            ap()
+        builtins._ = "builtin"
+        self.assertEqual(printed(caller), aprint.pformat([1]) + "\n")
+    
+    def test_builtin(self):
+        # As set by the interactive interpreter
+        def caller():
+            ap()
+        builtins._ = 123
+        self.assertEqual(printed(caller), "123\n")
+    
+    def test_only_the_caller(self):
+        def inner():
+            ap()
+        def outer():
+            _ = "outer"
+            inner()
+        builtins._ = "builtin"
+        self.assertEqual(printed(outer), "'builtin'\n")
+    
+    def test_undefined(self):
+        if hasattr(builtins, "_"):
+            del builtins._
+        with self.assertRaises(NameError):
+            printed(ap)
+
+
+if __name__ == "__main__":
+    unittest.main()
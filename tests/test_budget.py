@@ -0,0 +1,65 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+The max_depth, max_nodes and max_output_chars budgets
+
+    $ python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+def tree(width, depth):
+    if depth == 0:
+        return []
+    return [tree(width, depth - 1) for i in range(width)]
+
+
+def pformat(obj, **kw):
+    return aprint.pformat(obj, multiline=False, **kw)
+
+
+class BudgetTest(unittest.TestCase):
+    def test_max_depth(self):
+        self.assertEqual(
+            pformat([1, [2, [3, [4]]]], max_depth=2), "[1, [2, [... 2 items]]]")
+    
+    def test_max_nodes(self):
+        self.assertEqual(
+            pformat(list(range(10)), max_nodes=4), "[0, 1, 2, ... 7 more items]")
+        self.assertEqual(
+            aprint.pformat(list(range(10)), max_nodes=4),
+            "[\n    [0] 0\n    [1] 1\n    [2] 2\n    [... 7 more items]\n]")
+    
+    def test_labels_are_free(self):
+        # Dict keys are not charged to max_nodes, their values are
+        obj = {i: i for i in range(10)}
+        self.assertEqual(
+            pformat(obj, max_nodes=5, limit=None),
+            "{0: 0, 1: 1, 2: 2, 3: 3, ... 6 more items}")
+    
+    def test_max_output_chars(self):
+        # A tree which would print megabytes
+        obj = tree(8, 5)
+        s = aprint.pformat(obj, max_output_chars=100, limit=None)
+        self.assertLess(len(s), 1000)
+        self.assertEqual(
+            "".join(aprint.iter_pformat(obj, max_output_chars=100, limit=None)), s)
+    
+    def test_streamed(self):
+        obj = {"a": tree(3, 3), "b": list(range(50)), "c": "spam" * 20}
+        for kw in ({"max_nodes": 20}, {"max_output_chars": 200},
+                {"max_depth": 2}, {"max_nodes": 30, "max_output_chars": 300}):
+            with self.subTest(**kw):
+                self.assertEqual(
+                    "".join(aprint.iter_pformat(obj, limit=None, **kw)),
+                    aprint.pformat(obj, limit=None, **kw))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+bytes, array.array, memoryview and numpy.ndarray
+
+    $ python -m unittest discover tests
+'''
+import array
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def pformat(obj, **kw):
+    return aprint.pformat(obj, multiline=False, **kw)
+
+
+class BufferTest(unittest.TestCase):
+    def test_bytes(self):
+        self.assertEqual(pformat(b"ab\x00"), r"b'ab\x00'")
+        self.assertEqual(pformat(bytearray(b"ab\x00")), r"bytearray b'ab\x00'")
+    
+    def test_array(self):
+        self.assertEqual(pformat(array.array("i", [1, 2, 3])), "array('i') [1, 2, 3]")
+        self.assertEqual(pformat(array.array("d")), "array('d') []")
+        self.assertEqual(
+            pformat(array.array("i", range(100))),
+            "array('i') [0, 1, 2, 3, ..., 97, 98, 99]")
+        self.assertEqual(
+            aprint.pformat(array.array("i", [1, 2])), "array('i') [\n    [0] 1\n    [1] 2\n]")
+    
+    def test_memoryview(self):
+        self.assertEqual(
+            pformat(memoryview(b"abc")),
+            "memoryview(format='B', itemsize=1, shape=(3,), strides=(1,), readonly)"
+            " [97, 98, 99]")
+        self.assertEqual(
+            pformat(memoryview(array.array("i", range(100)))),
+            "memoryview(format='i', itemsize=4, shape=(100,), strides=(4,))"
+            " [0, 1, 2, 3, ..., 97, 98, 99]")
+    
+    def test_multidimensional_memoryview(self):
+        # Not indexable by an int: shown by its size
+        view = memoryview(bytes(range(24))).cast("B", (2, 3, 4))
+        self.assertEqual(
+            pformat(view),
+            "memoryview(format='B', itemsize=1, shape=(2, 3, 4), strides=(12, 4, 1),"
+            " readonly) [... 24 bytes]")
+    
+    def test_json(self):
+        node = json.loads(aprint.pformat(memoryview(b"ab"), doctype="json"))
+        self.assertEqual((node["len"], node["format"]), (2, "B"))
+        self.assertEqual([item["value"] for item in node["items"]], [97, 98])
+        node = json.loads(aprint.pformat(array.array("i", [1, 2]), doctype="json"))
+        self.assertEqual([item["value"] for item in node["items"]], [1, 2])
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class NdarrayTest(unittest.TestCase):
+    def test_header(self):
+        s = pformat(numpy.arange(100, dtype="int64"))
+        self.assertTrue(s.startswith("ndarray(dtype=int64, shape=(100,), strides=(8,)) ["))
+        self.assertIn("...", s)
+    
+    def test_lines(self):
+        s = aprint.pformat(numpy.zeros((3, 2)))
+        self.assertEqual(len(s.split("\n")), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
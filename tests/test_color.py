@@ -0,0 +1,95 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Color schemes, and rendering colored output
+
+    $ python -m unittest discover tests
+'''
+import io
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import colorama
+
+import aprint
+from aprint.formatcontext import (
+    ColorRenderer,
+    ComplexText,
+    DefaultColorScheme,
+    SingleText,
+)
+
+RESET = colorama.Style.RESET_ALL
+CYAN = colorama.Fore.CYAN + colorama.Style.BRIGHT
+RED = colorama.Fore.RED + colorama.Style.BRIGHT
+
+
+def text(*segments):
+    t = ComplexText()
+    for string, color in segments:
+        t += SingleText(string, color)
+    return t
+
+
+def colored(obj, **kw):
+    stream = io.StringIO()
+    aprint.pprint(obj, stream=stream, **kw)
+    return stream.getvalue()
+
+
+class ColorRendererTest(unittest.TestCase):
+    def setUp(self):
+        self.renderer = ColorRenderer(DefaultColorScheme().table())
+    
+    def render(self, *chunks):
+        return "".join(map(self.renderer, chunks)) + self.renderer.close()
+    
+    def test_transitions(self):
+        self.assertEqual(
+            self.render(text(("1", "int"), ("2", "int"), (" ", None), ("{", "dict"))),
+            CYAN + "12" + RESET + " " + RED + "{" + RESET)
+    
+    def test_same_sequences(self):
+        # int and float have the same colors: no transition
+        self.assertEqual(
+            self.render(text(("1", "int"), ("2.0", "float"))), CYAN + "12.0" + RESET)
+    
+    def test_across_chunks(self):
+        self.assertEqual(
+            self.render(text(("1", "int")), text(("2", "int")), "\n"),
+            CYAN + "12" + RESET + "\n")
+        self.assertEqual(self.renderer.close(), "")
+    
+    def test_uncolored(self):
+        self.assertEqual(self.render(text(("a", None)), "b"), "ab")
+
+
+class ColorSchemeTest(unittest.TestCase):
+    def test_same_text(self):
+        obj = {"a": [1, 2.5, None, True, "s"], (1, 2): {3}}
+        s = colored(obj)
+        self.assertIn(CYAN, s)
+        self.assertEqual(re.sub("\x1b\\[[0-9;]*m", "", s), aprint.pformat(obj) + "\n")
+    
+    def test_mutation(self):
+        scheme = DefaultColorScheme()
+        self.assertIn(CYAN, colored(1, color_scheme=scheme))
+        scheme["int", "fg"] = scheme.RED
+        self.assertIn(RED, colored(1, color_scheme=scheme))
+        del scheme["int", "fg"]
+        del scheme["int", "style"]
+        self.assertEqual(colored(1, color_scheme=scheme), "1\n")
+    
+    def test_colorize_override(self):
+        class Brackets(DefaultColorScheme):
+            def colorize(self, astr, color_key):
+                return "<{}>".format(astr) if color_key == "int" else astr
+        self.assertEqual(colored([1], color_scheme=Brackets(), multiline=False), "[<1>]\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
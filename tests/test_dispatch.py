@@ -0,0 +1,66 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+The choice of a formatter among the registrations
+
+    $ python -m unittest discover tests
+'''
+from dataclasses import dataclass
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+class Plain:
+    pass
+
+
+@dataclass
+class Data:
+    a: int
+
+
+def format_tag(obj, context):
+    return context.text("<tag>")
+
+
+class DispatchTest(unittest.TestCase):
+    def pformat(self, obj, builder):
+        return aprint.Printer(colored=False, builder=builder).pformat(obj)
+    
+    def test_type_registration(self):
+        printer = aprint.Printer(colored=False)
+        printer.add_type_formatter(Data, format_tag)
+        self.assertEqual(printer.pformat(Data(1)), "<tag>")
+        self.assertEqual(aprint.pformat(Data(1), multiline=False), "Data {a: 1}")
+    
+    def test_predicate_before_type_predicates(self):
+        # The formatter of objects by their fields only stands in for
+        # classes without a formatter, predicates included
+        builder = aprint.default_builder()
+        builder.add_predicate_formatter(
+            lambda obj: isinstance(obj, (Plain, Data)), format_tag)
+        plain = Plain()
+        plain.x = 1
+        self.assertEqual(self.pformat(plain, builder), "<tag>")
+        self.assertEqual(self.pformat(Data(1), builder), "<tag>")
+    
+    def test_predicate_after_types(self):
+        builder = aprint.default_builder()
+        builder.add_predicate_formatter(lambda obj: True, format_tag)
+        self.assertEqual(self.pformat(1, builder), "1")
+        builder.add_predicate_formatter(lambda obj: True, format_tag, priority=1)
+        self.assertEqual(self.pformat(1, builder), "<tag>")
+    
+    def test_base_class_before_type_predicates(self):
+        builder = aprint.default_builder()
+        builder.add_type_formatter(object, format_tag)
+        self.assertEqual(self.pformat(Data(1), builder), "<tag>")
+
+
+if __name__ == "__main__":
+    unittest.main()
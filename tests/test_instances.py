@@ -0,0 +1,116 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Namedtuples, dataclasses and plain objects formatted by their fields
+
+    $ python -m unittest discover tests
+'''
+from collections import namedtuple
+from dataclasses import dataclass, field
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+Point = namedtuple("Point", "x y")
+
+
+@dataclass
+class Data:
+    a: int
+    b: list = field(default_factory=list)
+    hidden: int = field(default=0, repr=False)
+
+
+@dataclass
+class EmptyData:
+    pass
+
+
+@dataclass(frozen=True)
+class Key:
+    a: int
+    b: int
+
+
+class Plain:
+    def __init__(self):
+        self.x = 1
+        self.y = "two"
+
+
+class Slots:
+    __slots__ = ("a", "b")
+    
+    def __init__(self, a):
+        self.a = a
+
+
+class Empty:
+    pass
+
+
+def pformat(obj, **kw):
+    return aprint.pformat(obj, multiline=False, **kw)
+
+
+class InstanceTest(unittest.TestCase):
+    def test_namedtuple(self):
+        self.assertEqual(pformat(Point(1, 2)), "Point {x: 1, y: 2}")
+    
+    def test_dataclass(self):
+        # The fields shown by its repr
+        self.assertEqual(pformat(Data(1, [2])), "Data {a: 1, b: [2]}")
+        self.assertEqual(aprint.pformat(Data(1)), "Data {\n    a: 1\n    b: []\n}")
+    
+    def test_dict(self):
+        obj = Plain()
+        obj.z = None
+        self.assertEqual(pformat(obj), "Plain {x: 1, y: 'two', z: None}")
+    
+    def test_slots(self):
+        # Unset slots are left out
+        self.assertEqual(pformat(Slots(1)), "Slots {a: 1}")
+    
+    def test_empty(self):
+        # By their str
+        self.assertEqual(pformat(EmptyData()), "EmptyData()")
+        for obj in (Empty(), object(), map(int, [])):
+            with self.subTest(obj=obj):
+                self.assertEqual(pformat(obj), str(obj))
+    
+    def test_own_repr(self):
+        class Repr(Plain):
+            def __repr__(self):
+                return "Repr()"
+        self.assertEqual(pformat(Repr()), "Repr()")
+    
+    def test_keys(self):
+        # On one line, like namedtuples are kept together
+        self.assertEqual(
+            aprint.pformat({Point(1, 2): "x"}),
+            "{\n    (1,\n     2): 'x'\n}")
+        self.assertEqual(
+            aprint.pformat({Key(1, 2): "x", Key(3, 4): "y"}),
+            "{\n    Key {a: 1, b: 2}: 'x'\n    Key {a: 3, b: 4}: 'y'\n}")
+    
+    def test_method(self):
+        # The object of a method is shown by its str, not its fields
+        obj = Plain()
+        self.assertEqual(pformat(obj.__init__), "{}.__init__()".format(obj))
+        printer = aprint.Printer()
+        self.assertEqual(
+            pformat(printer.pformat), "{}.pformat()".format(printer))
+    
+    def test_count(self):
+        self.assertEqual(pformat([[1]], max_depth=1), "[[... 1 item]]")
+        self.assertEqual(pformat([[1, 2]], max_depth=1), "[[... 2 items]]")
+        self.assertEqual(pformat([1, 2], max_nodes=2), "[1, ... 1 more item]")
+        self.assertEqual(pformat([1, 2, 3], max_nodes=2), "[1, ... 2 more items]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Invariants of the formatting: the output is the same whichever engine
+formats an object, and whether it is streamed or built in memory.
+Objects and options are drawn at random from fixed seeds.
+
+    $ python -m unittest discover tests
+'''
+from collections import (
+    defaultdict,
+    namedtuple,
+    OrderedDict,
+)
+from dataclasses import dataclass
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+Point = namedtuple("Point", "x y")
+
+
+@dataclass
+class Node:
+    value: object
+    next: object = None
+
+
+class Slots:
+    __slots__ = ("a", "b")
+    
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+
+def random_leaf(r):
+    return r.choice([
+        r.randint(-1000, 1000), r.random(), True, None,
+        "spam", "", "line\nbreak", "x" * r.randint(0, 80),
+        b"bytes\x00", (1, "one"), range(r.randint(0, 5)),
+    ])
+
+
+def random_object(r, depth, shared):
+    '''
+    A random tree of containers, instances and leaves, whose nodes are
+    sometimes reused (shared) elsewhere in the tree
+    '''
+    if depth == 0 or r.random() < 0.25:
+        return random_leaf(r)
+    if shared and r.random() < 0.1:
+        return r.choice(shared)
+    def child():
+        return random_object(r, depth - 1, shared)
+    n = r.randint(0, 9)
+    kind = r.randrange(9)
+    if kind == 0:
+        obj = [child() for i in range(n)]
+    elif kind == 1:
+        obj = tuple(child() for i in range(n))
+    elif kind == 2:
+        obj = {r.choice([i, str(i), (i, str(i)), i / 2]): child() for i in range(n)}
+    elif kind == 3:
+        obj = set(r.choice([i, str(i), (i,)]) for i in range(n))
+    elif kind == 4:
+        obj = OrderedDict((str(i), child()) for i in range(n))
+    elif kind == 5:
+        obj = defaultdict(list, {i: child() for i in range(n)})
+    elif kind == 6:
+        obj = Node(child(), child())
+    elif kind == 7:
+        obj = Slots(child(), random_leaf(r))
+    else:
+        obj = Point(child(), random_leaf(r))
+    shared.append(obj)
+    return obj
+
+
+def random_options(r):
+    kw = {}
+    if r.random() < 0.4:
+        kw["max_nodes"] = r.randint(1, 80)
+    if r.random() < 0.4:
+        kw["max_output_chars"] = r.randint(1, 800)
+    if r.random() < 0.3:
+        kw["max_depth"] = r.randint(1, 4)
+    if r.random() < 0.3:
+        kw["width"] = r.randint(10, 80)
+    if r.random() < 0.2:
+        kw["multiline"] = False
+    if r.random() < 0.3:
+        kw["shared_refs"] = True
+    if r.random() < 0.3:
+        kw["limit"] = r.choice([None, 2, 3])
+    if r.random() < 0.2:
+        kw["sort_keys"] = "insertion"
+    if r.random() < 0.2:
+        kw["max_str_length"] = r.choice([None, 8])
+    return kw
+
+
+class EngineTest(unittest.TestCase):
+    '''
+    The recursive and iterative engines, and pformat and iter_pformat,
+    give the same output
+    '''
+    cases = 300
+    
+    def check(self, doctype):
+        for seed in range(self.cases):
+            r = random.Random(seed)
+            obj = random_object(r, 4, [])
+            kw = random_options(r)
+            kw["doctype"] = doctype
+            expected = aprint.pformat(obj, engine="recursive", **kw)
+            with self.subTest(seed=seed, **kw):
+                self.assertEqual(
+                    aprint.pformat(obj, engine="iterative", **kw), expected)
+                self.assertEqual(
+                    aprint.pformat(obj, engine="auto", iterative_depth=1, **kw), expected)
+                self.assertEqual("".join(aprint.iter_pformat(
+                    obj, chunk_size=16, engine="recursive", **kw)), expected)
+                self.assertEqual("".join(aprint.iter_pformat(
+                    obj, engine="iterative", **kw)), expected)
+    
+    def test_text(self):
+        self.check("text")
+    
+    def test_json(self):
+        self.check("json")
+    
+    def test_jsonl(self):
+        self.check("jsonl")
+    
+    def test_deep(self):
+        obj = []
+        for i in range(3000):
+            obj = [obj]
+        # Beyond the recursion limit: only the iterative engine gets there
+        self.assertEqual(
+            "".join(aprint.iter_pformat(obj, indent=0, engine="iterative")),
+            aprint.pformat(obj, indent=0))
+    
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            aprint.pformat([1], engine="threaded")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+range, dict views, and iterators with the peek option
+
+    $ python -m unittest discover tests
+'''
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+def pformat(obj, **kw):
+    return aprint.pformat(obj, multiline=False, **kw)
+
+
+class RangeTest(unittest.TestCase):
+    def test_bounds(self):
+        self.assertEqual(pformat(range(10)), "range(0, 10)")
+        self.assertEqual(pformat(range(0, 10, 2)), "range(0, 10, 2)")
+        self.assertEqual(pformat(range(5, 0, -1)), "range(5, 0, -1)")
+        # Not iterated
+        self.assertEqual(pformat(range(10 ** 18)), "range(0, {})".format(10 ** 18))
+    
+    def test_json(self):
+        node = json.loads(aprint.pformat(range(0, 10, 3), doctype="json"))
+        del node["id"]
+        self.assertEqual(
+            node, {"type": "range", "start": 0, "stop": 10, "step": 3, "len": 4})
+
+
+class DictViewTest(unittest.TestCase):
+    def test_like_their_dict(self):
+        d = {"b": 1, "a": 2, "c": 3}
+        self.assertEqual(pformat(d.keys()), "dict_keys {'a', 'b', 'c'}")
+        self.assertEqual(pformat(d.values()), "dict_values [1, 2, 3]")
+        self.assertEqual(pformat(d.items()), "dict_items {'a': 2, 'b': 1, 'c': 3}")
+    
+    def test_empty(self):
+        self.assertEqual(pformat({}.keys()), "dict_keys {}")
+        self.assertEqual(pformat({}.values()), "dict_values []")
+        self.assertEqual(pformat({}.items()), "dict_items {}")
+    
+    def test_abbreviated(self):
+        d = {i: -i for i in range(100)}
+        self.assertEqual(
+            pformat(d.values()), "dict_values [0, -1, -2, -3, ..., -97, -98, -99]")
+        self.assertEqual(pformat(d.keys()), "dict_keys {0, 1, 2, 3, ..., 97, 98, 99}")
+
+
+class IteratorTest(unittest.TestCase):
+    def test_not_consumed(self):
+        it = iter([1, 2, 3])
+        self.assertEqual(pformat(it), str(it))
+        self.assertEqual(list(it), [1, 2, 3])
+    
+    def test_peek(self):
+        it = iter([1, 2, 3])
+        self.assertEqual(pformat(it, peek=2), "{} [1, 2, ...]".format(it))
+        # The peeked items are consumed, the others are left
+        self.assertEqual(list(it), [3])
+    
+    def test_peek_all(self):
+        gen = (i for i in range(2))
+        self.assertEqual(pformat(gen, peek=5), "{} [0, 1]".format(gen))
+        self.assertEqual(list(gen), [])
+    
+    def test_peek_once(self):
+        # Not advanced again when formatted twice, to fit a width
+        it = iter(range(10))
+        obj = {"it": it}
+        s = aprint.pformat(obj, peek=3, width=20)
+        self.assertIn("[2] 2", s)
+        self.assertNotIn("[3]", s)
+        self.assertEqual(next(it), 3)
+    
+    def test_json(self):
+        it = iter([1, 2, 3])
+        items = json.loads(aprint.pformat(it, peek=2, doctype="json"))["items"]
+        self.assertEqual([item.get("value") for item in items[:2]], [1, 2])
+        # May have more
+        self.assertEqual(items[2], {"omitted": None})
+        items = json.loads(aprint.pformat(iter([1]), peek=2, doctype="json"))["items"]
+        self.assertEqual(len(items), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+The json and jsonl doctypes
+
+    $ python -m unittest discover tests
+'''
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+def without_ids(node):
+    if isinstance(node, dict):
+        return {k: without_ids(v) for k, v in node.items() if k != "id"}
+    if isinstance(node, list):
+        return [without_ids(v) for v in node]
+    return node
+
+
+class JsonTest(unittest.TestCase):
+    def test_typed_tree(self):
+        s = aprint.pformat({"a": [1, 2.5, None]}, doctype="json")
+        self.assertEqual(without_ids(json.loads(s)), {
+            "type": "dict", "len": 1, "items": [[
+                {"type": "str", "value": "a", "len": 1},
+                {"type": "list", "len": 3, "items": [
+                    {"type": "int", "value": 1},
+                    {"type": "float", "value": 2.5},
+                    {"type": "NoneType", "value": None},
+                ]},
+            ]],
+        })
+    
+    def test_jsonl_is_one_line(self):
+        obj = {"a": [1, {"b": "line\nbreak"}]}
+        s = aprint.pformat(obj, doctype="jsonl")
+        self.assertNotIn("\n", s)
+        self.assertEqual(
+            json.loads(s), json.loads(aprint.pformat(obj, doctype="json")))
+    
+    def test_omitted(self):
+        s = aprint.pformat(list(range(10)), doctype="json", limit=3)
+        items = json.loads(s)["items"]
+        self.assertEqual(len(items), 4)
+        self.assertIn({"omitted": 7}, items)
+    
+    def test_keys_are_labels(self):
+        # Keys are not charged to max_nodes, in JSON as in text
+        obj = {i: i for i in range(10)}
+        text = aprint.pformat(obj, max_nodes=5, multiline=False)
+        s = aprint.pformat(obj, max_nodes=5, doctype="jsonl")
+        self.assertEqual(text.count(": "), s.count('[{"type": "int"'))
+    
+    def test_invalid_doctype(self):
+        with self.assertRaises(ValueError):
+            aprint.pformat(1, doctype="xml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+The memo of formatted leaves
+
+    $ python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+from aprint.formatcontext import FormatMemo
+
+
+class MemoTest(unittest.TestCase):
+    def test_same_output(self):
+        obj = [{"name": "spam", "id": i % 3, "pair": (1, "a")} for i in range(10)]
+        expected = aprint.pformat(obj, limit=None)
+        for memo in (True, 4, FormatMemo()):
+            with self.subTest(memo=memo):
+                self.assertEqual(aprint.pformat(obj, limit=None, memo=memo), expected)
+                self.assertEqual("".join(
+                    aprint.iter_pformat(obj, limit=None, memo=memo)), expected)
+    
+    def test_hits_and_misses(self):
+        memo = FormatMemo()
+        aprint.pformat(["spam", "spam", "ham"], memo=memo, multiline=False)
+        self.assertEqual(memo.stats(), {"hits": 1, "misses": 2, "size": 2})
+        # Kept from call to call
+        aprint.pformat(["spam", "spam", "ham"], memo=memo, multiline=False)
+        self.assertEqual(memo.stats(), {"hits": 4, "misses": 2, "size": 2})
+    
+    def test_lru(self):
+        memo = FormatMemo(maxsize=2)
+        aprint.pformat(["a", "b", "c", "a"], memo=memo, multiline=False)
+        self.assertEqual(memo.stats(), {"hits": 0, "misses": 4, "size": 2})
+        aprint.pformat(["c", "a"], memo=memo, multiline=False)
+        self.assertEqual(memo.stats()["hits"], 2)
+    
+    def test_long_strings(self):
+        memo = FormatMemo()
+        long = "x" * (FormatMemo.MAX_STR_LENGTH + 1)
+        aprint.pformat([long, long.encode(), (long,)], memo=memo, multiline=False)
+        self.assertEqual(memo.stats(), {"hits": 0, "misses": 0, "size": 0})
+    
+    def test_not_under_budget(self):
+        memo = FormatMemo()
+        aprint.pformat(["spam", "spam"], memo=memo, max_nodes=10)
+        self.assertEqual(memo.stats(), {"hits": 0, "misses": 0, "size": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
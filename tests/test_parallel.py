@@ -0,0 +1,61 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Formatting the items of large containers in worker processes
+
+    $ python -m unittest discover tests
+'''
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+from aprint import parallel
+from aprint.formatcontext import Options
+
+from test_invariants import random_object
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "workers need fork")
+class WorkersTest(unittest.TestCase):
+    '''
+    Formatting the items in worker processes gives the same output
+    as formatting them serially
+    '''
+    def check(self, obj, **kw):
+        expected = aprint.pformat(obj, **kw)
+        self.assertEqual(aprint.pformat(obj, workers=3, **kw), expected)
+        # Not formatted serially in disguise
+        printer = aprint.Printer(colored=False, **kw)
+        self.assertEqual(
+            parallel.pformat(obj, printer._builder, printer._plain_options, 3),
+            expected)
+    
+    def test_random(self):
+        r = random.Random(0)
+        shared = []
+        obj = [random_object(r, 3, shared) for i in range(parallel.MIN_JOBS)]
+        self.check(obj, limit=None)
+        self.check(obj, limit=None, doctype="json")
+    
+    def test_second_level(self):
+        r = random.Random(1)
+        obj = {"items": [random_object(r, 2, []) for i in range(parallel.MIN_JOBS)]}
+        self.check(obj, limit=None)
+    
+    def test_serial_fallback(self):
+        options = Options(color_scheme=aprint.NullColorScheme())
+        builder = aprint.default_builder()
+        # Too few items
+        self.assertIsNone(parallel.pformat([1, 2, 3, 4], builder, options, 4))
+        big = list(range(parallel.MIN_JOBS))
+        for kw in ({"width": 80}, {"max_nodes": 10}, {"shared_refs": True}):
+            options = Options(color_scheme=aprint.NullColorScheme(), **kw)
+            self.assertIsNone(parallel.pformat(big, builder, options, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+The profile option
+
+    $ python -m unittest discover tests
+'''
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+from aprint.formatcontext import FormatProfile
+
+OBJ = {"a": [1, 2], "b": "x"}
+
+
+class ProfileTest(unittest.TestCase):
+    def test_counters(self):
+        profile = FormatProfile()
+        s = aprint.pformat(OBJ, profile=profile)
+        stats = profile.stats()
+        self.assertEqual(stats["calls"], 1)
+        # The list indices are ints too
+        self.assertEqual(stats["types"], {"dict": 1, "list": 1, "str": 3, "int": 4})
+        self.assertEqual(
+            {name: f["calls"] for name, f in stats["formatters"].items()},
+            {"DictFormatter": 1, "ListFormatter": 1, "StrFormatter": 3, "format_int": 4})
+        self.assertEqual(stats["output_chars"], len(s))
+        self.assertGreater(stats["segments"], 0)
+        for f in stats["formatters"].values():
+            self.assertGreaterEqual(f["cumtime"], f["tottime"])
+    
+    def test_streamed(self):
+        profile = FormatProfile()
+        aprint.pformat(OBJ, profile=profile)
+        expected = profile.stats()
+        profile = FormatProfile()
+        s = "".join(aprint.iter_pformat(OBJ, profile=profile))
+        stats = profile.stats()
+        self.assertEqual(stats["output_chars"], len(s))
+        for key in ("calls", "types", "segments", "output_chars"):
+            self.assertEqual(stats[key], expected[key], key)
+    
+    def test_add_up(self):
+        calls = []
+        profile = FormatProfile(callback=lambda p: calls.append(p.stats()["calls"]))
+        aprint.pformat(OBJ, profile=profile)
+        aprint.pformat(OBJ, profile=profile)
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(profile.stats()["types"]["int"], 8)
+    
+    def test_callback(self):
+        profiles = []
+        aprint.pformat(OBJ, profile=profiles.append)
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0].stats()["types"]["dict"], 1)
+    
+    def test_report(self):
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            aprint.pformat([1], profile=True)
+        lines = err.getvalue().split("\n")
+        self.assertTrue(lines[0].startswith("1 calls, "))
+        self.assertIn("ListFormatter", err.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
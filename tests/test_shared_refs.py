@@ -0,0 +1,61 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+The shared_refs option
+
+    $ python -m unittest discover tests
+'''
+from dataclasses import dataclass
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+@dataclass
+class Node:
+    value: object
+    next: object = None
+
+
+def pformat(obj, **kw):
+    return aprint.pformat(obj, multiline=False, **kw)
+
+
+class SharedRefsTest(unittest.TestCase):
+    def test_labels(self):
+        a = [1, 2]
+        obj = {"x": a, "y": a}
+        self.assertEqual(pformat(obj, shared_refs=True), "{'x': &1 [1, 2], 'y': *1}")
+        self.assertEqual(pformat(obj), "{'x': [1, 2], 'y': [1, 2]}")
+    
+    def test_nested(self):
+        a = [1, 2]
+        self.assertEqual(pformat([(a,), (a,)], shared_refs=True), "[(&1 [1, 2],), (*1,)]")
+    
+    def test_leaves(self):
+        # Immutable leaves are not labelled
+        s = "spam"
+        self.assertEqual(pformat([s, s, 1, 1], shared_refs=True), "['spam', 'spam', 1, 1]")
+    
+    def test_diamond_of_instances(self):
+        obj = [0]
+        for i in range(30):
+            obj = Node(obj, obj)
+        s = aprint.pformat(obj, shared_refs=True)
+        # Each level is printed once, then referred to
+        self.assertEqual(s.count("Node"), 30)
+    
+    def test_json(self):
+        a = [1, 2]
+        items = json.loads(aprint.pformat([a, a], shared_refs=True, doctype="json"))["items"]
+        self.assertEqual(items[0]["label"], 1)
+        self.assertEqual(items[1], {"type": "list", "id": id(a), "ref": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
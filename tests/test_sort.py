@@ -0,0 +1,99 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+The sort_keys option, and the head and tail of abbreviated dicts and sets
+
+    $ python -m unittest discover tests
+'''
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+from aprint.formatter import select_head_tail, sort_items
+
+
+def pformat(obj, **kw):
+    return aprint.pformat(obj, multiline=False, **kw)
+
+
+class SortKeysTest(unittest.TestCase):
+    def test_modes(self):
+        obj = {'bb': 1, 'a': 2, 'ccc': 3}
+        self.assertEqual(pformat(obj), "{'a': 2, 'bb': 1, 'ccc': 3}")
+        self.assertEqual(pformat(obj, sort_keys=True), pformat(obj))
+        self.assertEqual(
+            pformat(obj, sort_keys="insertion"), "{'bb': 1, 'a': 2, 'ccc': 3}")
+        self.assertEqual(
+            pformat(obj, sort_keys=False), pformat(obj, sort_keys="insertion"))
+        self.assertEqual(
+            pformat(obj, sort_keys=lambda k: -len(k)), "{'ccc': 3, 'bb': 1, 'a': 2}")
+    
+    def test_mixed_types(self):
+        # Numbers first, then grouped by type name
+        obj = {'b': 1, 2: 2, 'a': 3, 1.5: 0, (1,): 1}
+        self.assertEqual(pformat(obj), "{1.5: 0, 2: 2, 'a': 3, 'b': 1, (1,): 1}")
+    
+    def test_unorderable(self):
+        obj = {complex(i, 1): i for i in range(3)}
+        self.assertEqual(pformat(obj), "{1j: 0, (1+1j): 1, (2+1j): 2}")
+    
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            pformat({}, sort_keys="reversed")
+    
+    def test_function_errors_are_raised(self):
+        def key(item):
+            raise ZeroDivisionError
+        for obj in ({1: 1, 2: 2}, set(range(20))):
+            with self.subTest(obj=obj), self.assertRaises(ZeroDivisionError):
+                pformat(obj, sort_keys=key)
+
+
+class HeadTailTest(unittest.TestCase):
+    '''
+    select_head_tail picks the same items as sorting them all
+    '''
+    def check(self, items, sort_keys="sorted"):
+        ordered = sort_items(items, sort_keys)
+        for head_len, tail_len in ((3, 2), (2, 0), (0, 3)):
+            head, tail = select_head_tail(items, head_len, tail_len, sort_keys)
+            self.assertEqual(head, ordered[:head_len])
+            self.assertEqual(tail, ordered[len(ordered) - tail_len:])
+    
+    def test_sorted(self):
+        self.check(set(range(100)))
+        self.check({str(i): i for i in range(100)})
+    
+    def test_mixed_types(self):
+        self.check({1, 2.5, "a", "b", (1,), (2,), None, 0, "c"})
+    
+    def test_unorderable(self):
+        # Taken in iteration order
+        self.check({complex(i, 1): i for i in range(10)})
+        self.check({object() for i in range(10)})
+    
+    def test_insertion(self):
+        self.check({str(i): i for i in range(10)}, "insertion")
+    
+    def test_key_function_ties(self):
+        self.check(set(range(100)), lambda i: i % 3)
+        self.check({str(i): i for i in range(100)}, len)
+    
+    def test_nan(self):
+        # NaNs don't compare: they may be anywhere, but only once
+        for seed in range(200):
+            r = random.Random(seed)
+            items = set(float("nan") if r.random() < 0.3 else r.random()
+                for i in range(20))
+            head, tail = select_head_tail(items, 3, 3)
+            self.assertEqual(len(head), 3)
+            self.assertEqual(len(tail), 3)
+            self.assertTrue(set(map(id, head)).isdisjoint(map(id, tail)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+#!python3
+# -*- coding: ascii -*-
+'''
+Escaping and shortening of str and bytes
+
+    $ python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import aprint
+
+
+class StrTest(unittest.TestCase):
+    def test_escapes(self):
+        self.assertEqual(aprint.pformat("a\nb\tc\rd"), r"'a\nb\tc\rd'")
+        self.assertEqual(aprint.pformat("\x00\x1b\x7f\x85"), r"'\x00\x1b\x7f\x85'")
+        self.assertEqual(aprint.pformat("\u2028\u2029"), r"'\u2028\u2029'")
+        self.assertEqual(aprint.pformat("back\\slash"), r"'back\\slash'")
+        # Printable text is kept as it is
+        self.assertEqual(aprint.pformat("caf\xe9"), "'caf\xe9'")
+    
+    def test_one_line(self):
+        s = aprint.pformat(["line\n" * 3, {"key\n": "value\r\n"}])
+        self.assertEqual(s.count("\n"), 5)
+    
+    def test_head_and_tail(self):
+        self.assertEqual(
+            aprint.pformat("0123456789" * 5, max_str_length=10), "'012...6789'")
+        self.assertEqual(aprint.pformat("x" * 40), "'" + "x" * 14 + "..." + "x" * 15 + "'")
+        self.assertEqual(
+            aprint.pformat("0123456789" * 5, max_str_length=None), repr("0123456789" * 5))
+        self.assertEqual(aprint.pformat("0123456789", max_str_length=10), "'0123456789'")
+    
+    def test_escaped_head_and_tail(self):
+        # Only the shown slices are escaped; the length is counted before
+        s = "\n" * 10 ** 6
+        self.assertEqual(aprint.pformat(s, max_str_length=10), r"'\n\n\n...\n\n\n\n'")
+    
+    def test_bytes(self):
+        self.assertEqual(aprint.pformat(b"a\x00b\xff\n"), r"b'a\x00b\xff\n'")
+        self.assertEqual(
+            aprint.pformat(b"0123456789" * 5, max_str_length=10), "b'012...6789'")
+        self.assertEqual(
+            aprint.pformat(bytearray(b"0123456789" * 5), max_str_length=10),
+            "bytearray b'012...6789'")
+
+
+if __name__ == "__main__":
+    unittest.main()